@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import os, re, csv, glob, time, argparse
+import cv2
+import numpy as np
+import blob_detection.img_processing as ip
+import blob_detection.recording as rec
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+# Define input arguments for command line call
+argParser = argparse.ArgumentParser(description="Run blob detection on a folder (or glob) of saved image frames or on "
+                                                "a recorded session.")
+argParser.add_argument("source", help="Folder of saved frames, glob pattern (e.g. 'C:/data/M*.png') or recorded "
+                                      "session folder (rec_<date>)")
+argParser.add_argument("-o", "--output", help="Path to output CSV. Default: batch_results_<date>.csv in source folder")
+argParser.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes. Default: CPUs")
+argParser.add_argument("-t", "--threshold", type=int, default=None, help="Detection threshold")
+argParser.add_argument("--contours", type=int, nargs=2, default=None, help="Lower and upper blob area limits")
+argParser.add_argument("--circularity", type=float, nargs=2, default=None, help="Lower and upper circularity limits")
+argParser.add_argument("--circle_fit", action="store_true", help="Fit a circle to found blobs")
+argParser.add_argument("--pyramid", type=int, default=None, help="Find candidates on a 2x or 4x downsampled image")
+
+IMAGE_EXTENSIONS = (".png", ".tif", ".tiff", ".bmp", ".jpg", ".npy")
+RESULT_HEADER = ["File", "X (pxl)", "Y (pxl)", "Area (pxl)", "Circularity", "Load (ms)", "Detect (ms)"]
+SESSION_HEADER = ["Frame", "Sequence", "Timestamp (s)", "X (pxl)", "Y (pxl)", "Area (pxl)", "Circularity",
+                  "Saturation (%)", "Detect (ms)"]
+SESSION_BATCH_FRAMES = 64
+
+
+def find_frames(source):
+    """
+    Find the image frames referenced by a folder or glob pattern, in natural order (M2.png before M10.png).
+    :param source: (str) Folder containing frames or glob pattern.
+    :return: (str list) Paths to image frames.
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source)
+    paths = [path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS)]
+
+    return sorted(paths, key=lambda path: [int(s) if s.isdigit() else s.lower() for s in re.split(r"(\d+)", path)])
+
+
+def load_frame(image_path):
+    """
+    Load a saved frame back into the channel order used by the live stream (see rec.ImageWriter).
+    :param image_path: (str) Path to image file.
+    :return: (np.array) Image array or None if it could not be read.
+    """
+    if image_path.lower().endswith(".npy"):
+        return np.load(image_path)
+    image_array = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if image_array is not None and len(image_array.shape) == 3:
+        image_array = cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
+
+    return image_array
+
+
+def detect_frame(image_path, detection_kwargs):
+    """
+    Worker call: load a single frame and detect its blob.
+    :param image_path: (str) Path to image file.
+    :param detection_kwargs: (dict) Keyword arguments for ip.measure_blobs.
+    :return: (list) Row of results in the order of RESULT_HEADER.
+    """
+    start = time.perf_counter()
+    image_array = load_frame(image_path)
+    load_ms = (time.perf_counter() - start) * 1000
+    if image_array is None:
+        return [image_path, "", "", "", "", "%.2f" % load_ms, ""]
+
+    start = time.perf_counter()
+    blobs = ip.measure_blobs(image_array, **detection_kwargs)
+    detect_ms = (time.perf_counter() - start) * 1000
+    center = ip.blob_center(blobs)
+    area, circularity = (blobs[-1]["area"], blobs[-1]["circularity"]) if blobs else (0, 0)
+
+    return [image_path, center[0], center[1], area, "%.4f" % circularity, "%.2f" % load_ms, "%.2f" % detect_ms]
+
+
+def detect_folder(source, output_path=None, workers=None, **detection_kwargs):
+    """
+    Detect blobs in every frame of a folder (or glob) across a process pool and write one CSV of results.
+    :param source: (str) Folder containing frames or glob pattern.
+    :param output_path: (str) Path to output CSV. Default: batch_results_<date>.csv next to the frames.
+    :param workers: (int) Number of worker processes. Default: number of CPUs.
+    :param detection_kwargs: Keyword arguments for ip.measure_blobs (threshold, contour_limits, circle_limits, ...)
+    :return: (str) Path to output CSV.
+    """
+    frame_paths = find_frames(source)
+    if output_path is None:
+        folder = source if os.path.isdir(source) else os.path.split(source)[0]
+        output_path = os.path.join(folder, "batch_results_%s.csv" % datetime.now().strftime("%Y%m%d-%H%M%S"))
+
+    # Detect across processes; results are written in input order
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunk_size = max(1, len(frame_paths) // (4 * (workers or os.cpu_count() or 1)))
+        rows = executor.map(detect_frame, frame_paths, [detection_kwargs] * len(frame_paths), chunksize=chunk_size)
+        with open(output_path, "w", newline="") as f:
+            writer_object = csv.writer(f)
+            writer_object.writerow(RESULT_HEADER)
+            writer_object.writerows(rows)
+    elapsed = time.perf_counter() - start
+    print("Processed %i frames in %.1f s. Saved results to: %s" % (len(frame_paths), elapsed, output_path))
+
+    return output_path
+
+
+def detect_recorded_frames(session_path, frame_nums, detection_kwargs):
+    """
+    Worker call: measure saturation and detect blobs in a range of recorded frames, the same way the live stream does.
+    :param session_path: (str) Path to the recorded session folder.
+    :param frame_nums: (range) Frame numbers to process.
+    :param detection_kwargs: (dict) Keyword arguments for ip.measure_blobs.
+    :return: (list list) Rows of results in the order of SESSION_HEADER.
+    """
+    recording = rec.Recording(session_path)
+    rows = []
+    for frame_num in frame_nums:
+        start = time.perf_counter()
+        context = ip.FrameContext(recording.frame(frame_num), frame_num)
+        saturation = ip.measure_saturation(context.histogram())
+        blobs = ip.measure_blobs(context.image_array, context=context, **detection_kwargs)
+        detect_ms = (time.perf_counter() - start) * 1000
+        center = ip.blob_center(blobs)
+        area, circularity = (blobs[-1]["area"], blobs[-1]["circularity"]) if blobs else (0, 0)
+        index = recording.index[frame_num]
+        rows.append([frame_num, index["sequence"], "%.4f" % (index["timestamp"] - recording.session["Start Counter"]),
+                     center[0], center[1], area, "%.4f" % circularity, "%.2f" % saturation["saturation"],
+                     "%.2f" % detect_ms])
+
+    return rows
+
+
+def detect_session(session_path, output_path=None, workers=None, **detection_kwargs):
+    """
+    Re-analyse every frame of a recorded session across a process pool and write one CSV of results. Frames are read
+    from the memory-mapped recording, so this runs as fast as the CPUs allow.
+    :param session_path: (str) Path to the recorded session folder.
+    :param output_path: (str) Path to output CSV. Default: replay_results_<date>.csv in the session folder.
+    :param workers: (int) Number of worker processes. Default: number of CPUs.
+    :param detection_kwargs: Keyword arguments for ip.measure_blobs (threshold, contour_limits, circle_limits, ...)
+    :return: (str) Path to output CSV.
+    """
+    frame_count = len(rec.Recording(session_path))
+    if output_path is None:
+        output_path = os.path.join(session_path, "replay_results_%s.csv" % datetime.now().strftime("%Y%m%d-%H%M%S"))
+    batches = [range(i, min(i + SESSION_BATCH_FRAMES, frame_count))
+               for i in range(0, frame_count, SESSION_BATCH_FRAMES)]
+
+    # Detect across processes; results are written in frame order
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(detect_recorded_frames, [session_path] * len(batches), batches,
+                               [detection_kwargs] * len(batches))
+        with open(output_path, "w", newline="") as f:
+            writer_object = csv.writer(f)
+            writer_object.writerow(SESSION_HEADER)
+            for rows in results:
+                writer_object.writerows(rows)
+    elapsed = time.perf_counter() - start
+    print("Processed %i frames in %.1f s (%.0f fps). Saved results to: %s" % (frame_count, elapsed,
+                                                                            frame_count / max(elapsed, 1e-9),
+                                                                            output_path))
+
+    return output_path
+
+
+def run_batch():
+    """
+    Command line entry point for batch detection.
+    """
+    args = argParser.parse_args()
+    detection_kwargs = {"threshold": args.threshold, "contour_limits": args.contours, "circle_limits": args.circularity,
+                        "fit_circle": args.circle_fit or None, "pyramid": args.pyramid}
+    if rec.is_session(args.source):
+        detect_session(args.source, output_path=args.output, workers=args.workers, **detection_kwargs)
+    else:
+        detect_folder(args.source, output_path=args.output, workers=args.workers, **detection_kwargs)
+
+
+if __name__ == "__main__":
+    run_batch()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+import os, re, sys, json, time, platform, argparse, subprocess, tracemalloc
+import cv2
+import numpy as np
+import blob_detection.img_processing as ip
+
+# Define input arguments for command line call
+argParser = argparse.ArgumentParser(description="Benchmark the frame processing path on synthetic frames.")
+argParser.add_argument("-r", "--repeat", type=int, default=20, help="Timed runs per case")
+argParser.add_argument("-k", "--filter", default="", help="Only run cases whose name matches this regex")
+argParser.add_argument("-o", "--output", help="Write results to this JSON file")
+argParser.add_argument("-b", "--baseline", help="Compare against this results JSON and fail on regression")
+argParser.add_argument("-t", "--tolerance", type=float, default=0.25,
+                       help="Allowed slowdown of the median vs. the baseline (0.25 = 25%%)")
+argParser.add_argument("-s", "--slack", type=float, default=0.5,
+                       help="Allowed absolute slowdown in ms, so sub-millisecond cases do not fail on timer jitter")
+argParser.add_argument("--startup", action="store_true",
+                       help="Also time cold starts of the command line runner (blob-detect) in a fresh interpreter")
+
+FRAME_SHAPE = (1520, 1920)
+FRAME_FORMATS = [("rgb", 8), ("rgb", 16), ("mono", 8), ("mono", 16)]
+BLOB_COUNTS = [0, 1, 500]
+VIEW_SIZE = (457, 334)  # viewport of the stream window
+# Modules the command line runner must not import (GUI and camera drivers)
+GUI_MODULES = ["PySide6", "PyQt5", "matplotlib", "pylablib"]
+
+
+def make_frames(seed=0):
+    """
+    Make the synthetic benchmark frames: every frame format with 0 blobs (noise only), 1 blob and 500 speckles.
+    :param seed: (int) Seed for blob placement and noise.
+    :return: (dict) Image arrays by name, e.g. 'rgb8_1blob'.
+    """
+    rng = np.random.default_rng(seed)
+    frames = {}
+    for n_blobs in BLOB_COUNTS:
+        if n_blobs == 1:
+            centers, radius = [(FRAME_SHAPE[1] / 2 + 0.3, FRAME_SHAPE[0] / 2 + 0.7)], 18
+        else:
+            centers = rng.uniform((20, 20), (FRAME_SHAPE[1] - 20, FRAME_SHAPE[0] - 20), size=(n_blobs, 2))
+            radius = 5  # speckles below the lower contour limit
+        for color, bit_depth in FRAME_FORMATS:
+            name = "%s%i_%iblob" % (color, bit_depth, n_blobs)
+            frames[name] = ip.synthetic_frame(FRAME_SHAPE, centers, radius=radius, color=color, bit_depth=bit_depth,
+                                              seed=seed)
+
+    return frames
+
+
+def saturation(image_array, stride=1):
+    """
+    Saturation computation of ThreadStream.get_saturation (without the GUI update).
+    :param image_array: (np.array) Image frame.
+    :param stride: (int) Histogram stride ("Saturation Stride" in the config).
+    :return: (dict) Output of ip.measure_saturation.
+    """
+    return ip.measure_saturation(ip.FrameContext(image_array).histogram(stride=stride))
+
+
+def preview(image_array):
+    """
+    Display path of ThreadStream.publish_frame for the whole frame on the default stream window.
+    :param image_array: (np.array) Image frame.
+    :return: (np.array) Preview image.
+    """
+    rgb8 = ip.convert_color_bit(image_array, "rgb", 8, buffer="rgb8")
+    region, scale = ip.preview_region(rgb8.shape, VIEW_SIZE)
+
+    return ip.render_preview(rgb8, region, scale)
+
+
+def make_cases(frames):
+    """
+    Make the benchmark cases for every frame.
+    :param frames: (dict) Output of make_frames.
+    :return: (dict) Zero-argument functions by case name.
+    """
+    cases = {}
+    for name, frame in frames.items():
+        cases["convert_mono8/%s" % name] = lambda f=frame: ip.convert_color_bit(f, "mono", 8)
+        cases["convert_rgb8/%s" % name] = lambda f=frame: ip.convert_color_bit(f, "rgb", 8)
+        cases["detect_moments/%s" % name] = lambda f=frame: ip.detect_blob(f, fit_circle=False)
+        cases["detect_circle/%s" % name] = lambda f=frame: ip.detect_blob(f, fit_circle=True)
+        cases["saturation/%s" % name] = lambda f=frame: saturation(f)
+        cases["saturation_stride2/%s" % name] = lambda f=frame: saturation(f, stride=2)
+        cases["preview/%s" % name] = lambda f=frame: preview(f)
+
+    return cases
+
+
+def launch_runner(runner_args=None):
+    """
+    Start the command line runner (blob-detect) in a fresh interpreter and wait for it to finish. Fails if the runner
+    imported a GUI module or camera driver.
+    :param runner_args: (str list) Arguments for measure.run_measurement. Default: only import the runner.
+    """
+    code = "import sys, blob_detection.measure as measure\nexit_code = 0\n"
+    if runner_args is not None:
+        code += "exit_code = measure.run_measurement(%r)\n" % runner_args
+    code += "print(' '.join(sorted(set(%r) & set(sys.modules))))\nsys.exit(exit_code)\n" % GUI_MODULES
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-c", code], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError("Runner failed: %s" % result.stderr.strip())
+    if result.stdout.strip():
+        raise RuntimeError("Runner imported: %s" % result.stdout.strip())
+
+
+def make_startup_cases():
+    """
+    Make the startup cases: import the runner, and launch it for one measured frame of the synthetic camera (time from
+    process start to the first logged result and a clean shutdown).
+    :return: (dict) Zero-argument functions by case name.
+    """
+    return {"startup/import": lambda: launch_runner(),
+            "startup/first_result": lambda: launch_runner(["-b", "Synthetic", "-f", "1", "-o", os.devnull])}
+
+
+def time_case(function, repeat):
+    """
+    Time a case and measure its peak Python/NumPy memory in a separate (untimed) run.
+    :param function: (function) Zero-argument benchmark function.
+    :param repeat: (int) Number of timed runs.
+    :return: (dict) 'median_ms', 'p99_ms' and 'peak_mb'.
+    """
+    function()  # warm up (lazy allocations, reusable buffers)
+    times = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times[i] = time.perf_counter() - start
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"median_ms": float(np.median(times) * 1000), "p99_ms": float(np.percentile(times, 99) * 1000),
+            "peak_mb": peak / 2 ** 20}
+
+
+def run_benchmarks(repeat=20, pattern="", startup=False):
+    """
+    Run the benchmark suite.
+    :param repeat: (int) Number of timed runs per case.
+    :param pattern: (str) Only run cases whose name matches this regex.
+    :param startup: (bool) Also run the startup cases (see make_startup_cases).
+    :return: (dict) 'meta' (environment) and 'results' (timings by case name).
+    """
+    cv2.setRNGSeed(0)
+    cases = make_startup_cases() if startup else {}
+    cases.update(make_cases(make_frames()))
+    results = {}
+    for name, function in cases.items():
+        if re.search(pattern, name):
+            results[name] = time_case(function, repeat)
+            print("%-40s median %8.2f ms   p99 %8.2f ms   peak %7.1f MB" % (name, results[name]["median_ms"],
+                                                                          results[name]["p99_ms"],
+                                                                          results[name]["peak_mb"]))
+    meta = {"python": platform.python_version(), "numpy": np.__version__, "opencv": cv2.__version__,
+            "platform": platform.platform(), "processor": platform.processor(), "repeat": repeat}
+
+    return {"meta": meta, "results": results}
+
+
+def compare_baseline(results, baseline, tolerance=0.25, slack=0.5):
+    """
+    Find the cases whose median latency regressed against a baseline.
+    :param results: (dict) Output of run_benchmarks.
+    :param baseline: (dict) Output of run_benchmarks for the reference version.
+    :param tolerance: (float) Allowed fractional slowdown of the median.
+    :param slack: (float) Allowed absolute slowdown of the median in ms.
+    :return: (str list) One message per regressed case.
+    """
+    regressions = []
+    for name, result in results["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is not None and result["median_ms"] > reference["median_ms"] * (1 + tolerance) + slack:
+            regressions.append("%s: %.2f ms vs. %.2f ms baseline" % (name, result["median_ms"],
+                                                                     reference["median_ms"]))
+
+    return regressions
+
+
+def run_suite():
+    """
+    Command line entry point for the benchmark suite.
+    """
+    args = argParser.parse_args()
+    results = run_benchmarks(repeat=args.repeat, pattern=args.filter, startup=args.startup)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        print("Saved results to:", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(results, baseline, tolerance=args.tolerance, slack=args.slack)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against:", args.baseline)
+
+
+if __name__ == "__main__":
+    run_suite()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import csv, time, threading
+import numpy as np
+from contextlib import contextmanager
+
+# Stages of the live stream in pipeline order (camera thread, then ThreadStream)
+STAGES = ["wait_for_frame", "reformat", "saturation", "detect", "overlay", "preview", "display"]
+# Upper edges of the latency histogram bins [ms]
+HISTOGRAM_EDGES_MS = [0.5, 1, 2, 5, 10, 20, 33, 50, 100, 200, 500, np.inf]
+
+
+class StageStats:
+
+    def __init__(self, window=300):
+        """
+        Rolling latency statistics of the stream stages, plus event rates (fps) and counters (dropped frames).
+        Samples are kept in fixed-size rings, so recording a sample never allocates.
+        :param window: (int) Number of latest samples kept per stage and event.
+        """
+        self.window = window
+        self.samples = {}  # stage: ring of latencies [s]
+        self.sample_counts = {}  # stage: number of samples recorded in total
+        self.events = {}  # event: ring of timestamps [s]
+        self.event_counts = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        """
+        Record the latency of one pass through a stage.
+        :param stage: (str) Name of the stage.
+        :param seconds: (float) Latency [s].
+        """
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = np.zeros(self.window)
+                self.sample_counts[stage] = 0
+            self.samples[stage][self.sample_counts[stage] % self.window] = seconds
+            self.sample_counts[stage] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Time the enclosed block as one pass through a stage: with stats.timer("detect"): ...
+        :param stage: (str) Name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def tick(self, event, timestamp=None):
+        """
+        Record an event (e.g. a frame acquired or displayed) for rate measurements.
+        :param event: (str) Name of the event.
+        :param timestamp: (float) Time of the event [s, time.perf_counter()]. Default: now.
+        """
+        with self.lock:
+            if event not in self.events:
+                self.events[event] = np.zeros(self.window)
+                self.event_counts[event] = 0
+            self.events[event][self.event_counts[event] % self.window] = time.perf_counter() \
+                if timestamp is None else timestamp
+            self.event_counts[event] += 1
+
+    def set_counter(self, name, value):
+        """
+        Set a counter (e.g. dropped frames).
+        :param name: (str) Name of the counter.
+        :param value: (int) Counter value.
+        """
+        self.counters[name] = value
+
+    def rate(self, event):
+        """
+        Get the rate of an event over the rolling window.
+        :param event: (str) Name of the event.
+        :return: (float) Events per second (0 if fewer than two events were recorded).
+        """
+        with self.lock:
+            n = min(self.event_counts.get(event, 0), self.window)
+            if n < 2:
+                return 0.0
+            last = (self.event_counts[event] - 1) % self.window
+            first = (self.event_counts[event] - n) % self.window
+            elapsed = self.events[event][last] - self.events[event][first]
+
+        return (n - 1) / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        """
+        Summarize the latency of every stage over the rolling window.
+        :return: (dict) Per stage: 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms' and 'histogram'
+                 (sample counts per bin of HISTOGRAM_EDGES_MS).
+        """
+        with self.lock:
+            windows = {stage: samples[:min(self.sample_counts[stage], self.window)] * 1000
+                       for stage, samples in self.samples.items()}
+            counts = dict(self.sample_counts)
+        stages = [stage for stage in STAGES if stage in windows] + sorted(set(windows) - set(STAGES))
+
+        summary = {}
+        for stage in stages:
+            samples_ms = windows[stage]
+            p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+            summary[stage] = {"count": counts[stage], "mean_ms": samples_ms.mean(), "p50_ms": p50, "p95_ms": p95,
+                              "p99_ms": p99, "max_ms": samples_ms.max(),
+                              "histogram": np.bincount(np.searchsorted(HISTOGRAM_EDGES_MS, samples_ms),
+                                                       minlength=len(HISTOGRAM_EDGES_MS))}
+
+        return summary
+
+    def report(self):
+        """
+        Format the stage latencies, rates and counters as a fixed-width table (diagnostics panel).
+        :return: (str) Table text.
+        """
+        lines = ["%-15s %7s %7s %7s %7s" % ("Stage (ms)", "mean", "p50", "p95", "max")]
+        for stage, stats in self.summary().items():
+            lines.append("%-15s %7.2f %7.2f %7.2f %7.2f" % (stage, stats["mean_ms"], stats["p50_ms"],
+                                                           stats["p95_ms"], stats["max_ms"]))
+        rates = ["%s %.1f fps" % (event, self.rate(event)) for event in sorted(self.events)]
+        counters = ["%s %i" % (name, value) for name, value in sorted(self.counters.items())]
+        lines.append(" | ".join(rates + counters))
+
+        return "\n".join(lines)
+
+    def save_csv(self, file_path):
+        """
+        Save the stage latencies (with histograms), rates and counters to a CSV.
+        :param file_path: (str) Path to CSV.
+        """
+        bin_names = ["<%g ms" % edge for edge in HISTOGRAM_EDGES_MS[:-1]] + [">=%g ms" % HISTOGRAM_EDGES_MS[-2]]
+        with open(file_path, "w", newline="") as f:
+            writer_object = csv.writer(f)
+            writer_object.writerow(["Stage", "Count", "Mean (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Max (ms)"] +
+                                   bin_names)
+            for stage, stats in self.summary().items():
+                writer_object.writerow([stage, stats["count"]] +
+                                       ["%.3f" % stats[key] for key in ["mean_ms", "p50_ms", "p95_ms", "p99_ms",
+                                                                        "max_ms"]] + list(stats["histogram"]))
+            writer_object.writerow([])
+            writer_object.writerow(["Counter", "Value"])
+            for event in sorted(self.events):
+                writer_object.writerow(["%s (fps)" % event, "%.2f" % self.rate(event)])
+            for name, value in sorted(self.counters.items()):
+                writer_object.writerow([name, value])
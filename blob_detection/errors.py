@@ -8,7 +8,13 @@ ERRORS = {
     0: "",
     404: "HW: UNKNOWN",
     801: "Amscope: Device already in use. Close any active sessions.",
-    802: "Amscope: Could not read frame. Check connections."
+    802: "Amscope: Could not read frame. Check connections.",
+    803: "HW: Unknown camera backend. Check 'Backend' in gui_settings.json.",
+    804: "Amscope: IMAQdx driver not available. Install pylablib and NI-IMAQdx.",
+    811: "OpenCV: Could not open video device.",
+    812: "OpenCV: Could not read frame. Check connections.",
+    821: "Replay: Could not open recording. Check 'Session' in gui_settings.json.",
+    822: "Replay: End of recording."
 }
 
 
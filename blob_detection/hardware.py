@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 
-import time, cv2, threading
+import time, cv2, math, threading
 import numpy as np
+import blob_detection.img_processing as ip
+import blob_detection.diagnostics as diag
+import blob_detection.recording as rec
 from blob_detection.errors import *
 from inspect import currentframe
-from pylablib.devices.IMAQdx import IMAQdx
 
 
 def check_path(save_path):
@@ -26,19 +28,425 @@ def check_path(save_path):
     return save_path
 
 
-class AmScopeCamNI:
+class FrameRing:
 
-    def __init__(self, device_id=0):
+    def __init__(self, capacity=8):
+        """
+        Fixed-capacity ring of preallocated frame slots with sequence numbers and acquisition timestamps. The camera
+        thread fills the next slot and publishes it; consumers read the latest frame without copying or block until
+        a newer one arrives. A published frame stays valid until capacity - 1 newer frames have been written.
+        :param capacity: (int) Number of frame slots.
+        """
+        self.capacity = max(int(capacity), 2)
+        self.slots = [None] * self.capacity
+        self.timestamps = np.zeros(self.capacity)
+        self.sequence = 0  # sequence number of the latest published frame (0 = none yet)
+        self.last_read = 0
+        self.dropped = 0
+        self.is_closed = False
+        self.condition = threading.Condition()
+
+    def next_slot(self, shape, dtype=np.uint8):
+        """
+        Get the slot the next frame will be published in, so a backend can write the frame into it directly. Slots
+        are only reallocated when the frame shape or dtype changes.
+        :param shape: (int tuple) Shape of the frame.
+        :param dtype: (np.dtype) Data type of the frame.
+        :return: (np.array) Slot array (not visible to consumers until publish()).
+        """
+        index = (self.sequence + 1) % self.capacity
+        slot = self.slots[index]
+        if slot is None or slot.shape != tuple(shape) or slot.dtype != dtype or not slot.flags.writeable:
+            slot = np.empty(shape, dtype)
+            self.slots[index] = slot
+
+        return slot
+
+    def publish(self, frame, timestamp=None, copy=True):
+        """
+        Publish a new frame. Frames that were written into next_slot() are published without copying; any other
+        array is copied into the slot unless copy is False.
+        :param frame: (np.array) Image frame.
+        :param timestamp: (float) Acquisition time [s, time.perf_counter()]. Default: now.
+        :param copy: (bool) Copy foreign arrays into the slot? False stores the array itself, which is only safe for
+                     arrays that are never modified afterwards (e.g. read-only memory-mapped recordings).
+        :return: (int) Sequence number of the frame.
+        """
+        if copy:
+            slot = self.next_slot(frame.shape, frame.dtype)
+            if frame is not slot:
+                np.copyto(slot, frame)
+        else:
+            self.slots[(self.sequence + 1) % self.capacity] = frame
+        with self.condition:
+            self.sequence += 1
+            self.timestamps[self.sequence % self.capacity] = time.perf_counter() if timestamp is None else timestamp
+            self.condition.notify_all()
+
+        return self.sequence
+
+    def latest(self):
+        """
+        Get the latest frame without copying.
+        :return: (int) sequence number, (float) timestamp, (np.array) frame or None if no frame was published yet.
+        """
+        with self.condition:
+            return self.read(self.sequence)
+
+    def wait_for_frame(self, last_sequence=0, timeout=None):
+        """
+        Block until a frame newer than last_sequence is published and return the latest frame without copying.
+        Frames that were published but never returned by wait_for_frame() are counted in self.dropped.
+        :param last_sequence: (int) Sequence number of the last frame the consumer handled.
+        :param timeout: (float) Maximum time to wait [s]. Default: wait until a frame arrives or the ring closes.
+        :return: (int) sequence number, (float) timestamp, (np.array) frame or None on timeout or close.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > last_sequence or self.is_closed, timeout)
+            if self.sequence <= last_sequence:
+                return last_sequence, 0, None
+            if self.sequence > self.last_read:
+                self.dropped += max(self.sequence - max(self.last_read, last_sequence) - 1, 0)
+                self.last_read = self.sequence
+                self.condition.notify_all()
+            return self.read(self.sequence)
+
+    def wait_until_read(self, sequence, timeout=None):
+        """
+        Block until a consumer has read the given frame through wait_for_frame() (lets a source run in lockstep with
+        its consumer instead of dropping frames).
+        :param sequence: (int) Sequence number of the frame.
+        :param timeout: (float) Maximum time to wait [s]. Default: wait until read or the ring closes.
+        :return: (bool) True if the frame was read.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.last_read >= sequence or self.is_closed, timeout) and \
+                self.last_read >= sequence
+
+    def wait_for_next(self, last_sequence=0, timeout=None):
+        """
+        Block until a frame newer than last_sequence is published and return the oldest such frame that is still in
+        the ring, so a consumer that keeps up sees every frame (e.g. a recorder). Does not change self.dropped.
+        :param last_sequence: (int) Sequence number of the last frame the consumer handled.
+        :param timeout: (float) Maximum time to wait [s]. Default: wait until a frame arrives or the ring closes.
+        :return: (int) sequence number, (float) timestamp, (np.array) frame or None on timeout or close.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > last_sequence or self.is_closed, timeout)
+            if self.sequence <= last_sequence:
+                return last_sequence, 0, None
+            return self.read(max(last_sequence + 1, self.sequence + 2 - self.capacity))
+
+    def read(self, sequence):
+        """
+        Read a published frame without copying.
+        :param sequence: (int) Sequence number of the frame.
+        :return: (int) sequence number, (float) timestamp, (np.array) frame or None if it is no longer in the ring.
+        """
+        if not self.is_valid(sequence):
+            return sequence, 0, None
+        index = sequence % self.capacity
+
+        return sequence, self.timestamps[index], self.slots[index]
+
+    def is_valid(self, sequence):
+        """
+        Check whether a frame is still held in the ring (not yet overwritten by newer frames).
+        :param sequence: (int) Sequence number of the frame.
+        :return: (bool) True if the frame can still be read.
+        """
+        return 0 < sequence <= self.sequence and sequence > self.sequence + 1 - self.capacity
+
+    def close(self):
+        """
+        Wake up all waiting consumers (the stream stopped).
+        """
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify_all()
+
+    def reopen(self):
+        """
+        Allow consumers to wait for frames again after close().
+        """
+        with self.condition:
+            self.is_closed = False
+
+
+CAMERA_BACKENDS = {"IMAQdx": "AmScopeCamNI", "OpenCV": "OpenCVCam", "Synthetic": "SyntheticCam", "Replay": "ReplayCam"}
+
+
+def get_device_id(camera_settings, camera_num=0):
+    """
+    Get the device number of a camera station from the settings json.
+    :param camera_settings: (dict) "Camera" section of the settings json.
+    :param camera_num: (int) Camera number: index into the "ID LR" device list (e.g. 0 = left, 1 = right).
+    :return: (int) Device number. Falls back to "ID" if there is no device list entry for the camera.
+    """
+    device_ids = camera_settings.get("ID LR", [])
+
+    return device_ids[camera_num] if camera_num < len(device_ids) else camera_settings["ID"]
+
+
+def load_camera(camera_settings, device_id=0, stats=None):
+    """
+    Open the camera backend selected in the settings json ("Camera" -> "Backend"). Backend drivers are only imported
+    once their camera is opened.
+    :param camera_settings: (dict) "Camera" section of the settings json.
+    :param device_id: (int) Device number of the camera.
+    :param stats: (diag.StageStats) Shared stage statistics. Default: new statistics for this camera.
+    :return: (Camera) Camera object or None if the backend is unknown.
+    """
+    backend = camera_settings.get("Backend", "IMAQdx")
+    if backend not in CAMERA_BACKENDS:
+        error_check(803, currentframe())
+        return None
+
+    return globals()[CAMERA_BACKENDS[backend]](device_id=device_id, settings=camera_settings.get(backend, {}),
+                                                 stats=stats)
+
+
+class CameraControl:
+
+    # Camera setter of each setting
+    SETTERS = {"exposure": "set_exposure", "gamma": "set_gamma", "gain": "set_gain"}
+
+    def __init__(self, camera):
+        """
+        Asynchronous command queue of a camera. Settings are validated against the camera's cached ranges when they
+        are submitted and applied by a control thread; a burst of commands for the same setting (e.g. a slider drag)
+        is coalesced to its latest value, and the driver gets at most one update per settled frame.
+        :param camera: (Camera) Camera the commands are applied to.
+        """
+        self.camera = camera
+        self.pending = {}  # setting: (value, submit time, callback)
+        self.effective = {}  # setting: (value, sequence, timestamp) of the first frame the setting was in effect on
+        self.is_running = False
+        self.condition = threading.Condition()
+        self.control_thread = threading.Thread(target=self.threaded_control, daemon=True)
+
+    def submit(self, setting, value, callback=None):
+        """
+        Queue a new value for a setting (replaces any value of the same setting that was not applied yet).
+        :param setting: (str) Options: 'exposure' [us], 'gamma' or 'gain'
+        :param value: (float) New value.
+        :param callback: (function) Called as callback(setting, value, sequence) once the setting is in effect on
+                         frame number sequence (None if the stream stopped first).
+        :return: (bool) True if the value was queued, False if it is out of range.
+        """
+        if not self.camera.is_in_range(setting, value):
+            return False
+        with self.condition:
+            self.pending[setting] = (float(value), time.perf_counter(), callback)
+            if not self.is_running:
+                self.is_running = True
+                self.control_thread.start()
+            self.condition.notify_all()
+
+        return True
+
+    def stop(self):
+        """
+        Stop the control thread (pending commands are discarded).
+        """
+        with self.condition:
+            self.is_running = False
+            self.pending = {}
+            self.condition.notify_all()
+        if self.control_thread.is_alive():
+            self.control_thread.join()
+        self.control_thread = threading.Thread(target=self.threaded_control, daemon=True)
+
+    def threaded_control(self):
+        """
+        Background thread: apply queued settings, then wait for the first frame that was entirely exposed after the
+        change and report it.
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or not self.is_running)
+                if not self.is_running:
+                    break
+                commands, self.pending = self.pending, {}
+
+            for setting, (value, submit_time, callback) in commands.items():
+                getattr(self.camera, self.SETTERS[setting])(new_value=value)
+            settle_time = time.perf_counter() + self.camera.exposure_us / 1e6
+
+            # Frames are timestamped when they arrive, so a frame is exposed with the new settings from settle_time on
+            sequence = self.camera.ring.sequence
+            timestamp = 0
+            while self.is_running and self.camera.is_streaming:
+                sequence, timestamp, frame = self.camera.ring.wait_for_next(sequence, timeout=0.5)
+                if frame is not None and timestamp >= settle_time:
+                    break
+            is_in_effect = self.is_running and self.camera.is_streaming
+
+            for setting, (value, submit_time, callback) in commands.items():
+                if is_in_effect:
+                    self.effective[setting] = (value, sequence, timestamp)
+                    self.camera.stats.add("set_" + setting, timestamp - submit_time)
+                if callback is not None:
+                    callback(setting, value, sequence if is_in_effect else None)
+
+
+class AutoExposure:
+
+    def __init__(self, camera):
+        """
+        Histogram-driven auto exposure. The 99.9th percentile level of the frame (the brightest 0.1% of pixels that
+        decide saturation, see ip.measure_saturation) is modelled as proportional to exposure^(1/gamma), so each step
+        sizes the exposure to put that level on the target. Once the frame is in the GOOD saturation band the
+        exposure is locked.
+        :param camera: (Camera) Streaming camera (settings are applied through its control queue).
+        """
+        self.camera = camera
+        self.target = 0.75  # target 99.9th percentile level (fraction of full scale), inside the GOOD band (0.5-0.95)
+        self.max_steps = 10
+        self.max_factor = 4  # largest exposure change per step
+        self.exposure_limits = None  # (min, max) exposure [us] the search may use, within the camera's range
+        self.state = "idle"  # "converging", "locked" (in band), "limit" (range limit reached) or "failed"
+        self.telemetry = []  # per step: sequence, exposure_us, level (99.9th percentile), saturation, factor
+        self.callback = None
+        self.is_running = False
+        self.auto_thread = threading.Thread(target=self.threaded_auto_exposure, daemon=True)
+
+    def start(self, target=None, max_steps=None, exposure_limits=None, callback=None):
+        """
+        Start converging the exposure (from the current exposure).
+        :param target: (float) Target 99.9th percentile level (fraction of full scale). Default: self.target
+        :param max_steps: (int) Maximum number of exposure steps before giving up. Default: self.max_steps
+        :param exposure_limits: (float tuple) Lowest and highest exposure [us] to use (e.g. the range of the GUI
+                                controls). Default: the camera's full range.
+        :param callback: (function) Called as callback(auto_exposure) once it locked, reached a limit or failed.
+        """
+        if self.is_running or self.camera.device is None:
+            return
+        if target is not None:
+            self.target = target
+        if max_steps is not None:
+            self.max_steps = max_steps
+        self.exposure_limits = exposure_limits
+        self.callback = callback
+        self.state = "converging"
+        self.telemetry = []
+        self.is_running = True
+        self.auto_thread = threading.Thread(target=self.threaded_auto_exposure, daemon=True)
+        self.auto_thread.start()
+
+    def stop(self):
+        """
+        Stop converging (keeps the current exposure).
+        """
+        self.is_running = False
+        if self.auto_thread.is_alive():
+            self.auto_thread.join()
+
+    def measure(self, sequence):
+        """
+        Measure the light level of the first frame from sequence on.
+        :param sequence: (int) Sequence number of the first frame that is exposed with the current settings.
+        :return: (int) sequence number, (dict) output of ip.measure_saturation or None if no frame arrived.
+        """
+        sequence, timestamp, frame = self.camera.ring.wait_for_next(sequence - 1, timeout=1)
+        if frame is None:
+            return sequence, None
+
+        return sequence, ip.measure_saturation(ip.FrameContext(frame).histogram(stride=2))
+
+    def next_exposure(self, saturation):
+        """
+        Model-based exposure step.
+        :param saturation: (dict) Output of ip.measure_saturation for the current exposure.
+        :return: (float) Exposure for the next step [us], (float) step factor.
+        """
+        level = saturation["percentiles"][99.9] / (2 ** 16 - 256)
+        if level >= 0.99:  # clipped: the true level is unknown, step down harder the more pixels are saturated
+            factor = 0.5 if saturation["saturation"] < 1 else 1 / self.max_factor
+        elif level <= 0.01:  # no signal above the noise floor
+            factor = self.max_factor
+        else:
+            factor = min(max((self.target / level) ** self.camera.gamma, 1 / self.max_factor), self.max_factor)
+        attr_min, attr_max = self.camera.ranges.get("exposure", (1, np.inf))
+        if self.exposure_limits is not None:
+            attr_min, attr_max = max(attr_min, self.exposure_limits[0]), min(attr_max, self.exposure_limits[1])
+
+        return min(max(self.camera.exposure_us * factor, attr_min), attr_max), factor
+
+    def threaded_auto_exposure(self):
+        """
+        Background thread: measure, step and wait for the new exposure to be in effect until the frame is in band.
+        """
+        start = time.perf_counter()
+        sequence = self.camera.ring.sequence + 1
+        for step in range(self.max_steps + 1):
+            sequence, saturation = self.measure(sequence)
+            if saturation is None or not self.is_running:
+                self.state = "failed"
+                break
+            exposure_us, factor = self.next_exposure(saturation)
+            self.telemetry.append({"sequence": sequence, "exposure_us": self.camera.exposure_us,
+                                   "level": saturation["percentiles"][99.9], "saturation": saturation["level"],
+                                   "factor": factor})
+            if saturation["level"] == "GOOD":
+                self.state = "locked"
+                break
+            if exposure_us == self.camera.exposure_us:
+                self.state = "limit"
+                break
+            if step == self.max_steps:
+                self.state = "failed"
+                break
+
+            # Apply and wait for the first frame exposed with the new setting
+            is_in_effect = threading.Event()
+            effect = {}
+            self.camera.control.submit("exposure", exposure_us,
+                                       callback=lambda setting, value, seq: (effect.update(sequence=seq),
+                                                                             is_in_effect.set()))
+            is_in_effect.wait(5)
+            if effect.get("sequence") is None:
+                self.state = "failed"
+                break
+            sequence = effect["sequence"]
+
+        self.is_running = False
+        self.camera.stats.add("auto_exposure", time.perf_counter() - start)
+        self.camera.stats.set_counter("auto_exposure_steps", len(self.telemetry) - 1)
+        print("Auto exposure %s at %i us after %i steps" % (self.state, self.camera.exposure_us,
+                                                            len(self.telemetry) - 1))
+        if self.callback is not None:
+            self.callback(self)
+
+
+class Camera:
+
+    def __init__(self, device_id=0, settings=None, stats=None):
+        """
+        Base class of the camera backends. Backends open the device in open() and grab frames in read_frame();
+        streaming, capture and display are shared.
+        :param device_id: (int) Device number of the camera.
+        :param settings: (dict) Backend settings from the settings json.
+        :param stats: (diag.StageStats) Stage statistics the acquisition timings are recorded to.
+        """
         # Variables
         self.device = None
         self.current_frame = np.array([])
         self.is_streaming = False
         self.scale_window = 3
         self.nodes = {}
+        self.frame_size = None  # (width, height) of raw frames, read from the device on first use
+        self.ring = FrameRing(settings.get("Ring Size", 8) if settings is not None else 8)
+        self.stats = stats if stats is not None else diag.StageStats()
+        self.is_zero_copy = False  # publish frames returned by read_frame() without copying them into the ring
+        self.ranges = {}  # setting: (min, max), read from the device once at open
+        self.control = CameraControl(self)
+        self.auto_exposure = AutoExposure(self)
         self.stream_thread = threading.Thread(target=self.threaded_stream, daemon=True)
 
         # Settings
         self.device_id = device_id
+        self.settings = settings if settings is not None else {}
         self.exposure_us = 200000
         self.gain = 0
         self.gamma = 1
@@ -47,71 +455,73 @@ class AmScopeCamNI:
 
     def open(self):
         """
-        Initiate a connection to the available camera, set default settings, and start streaming image data.
+        Initiate a connection to the camera, set default settings, and start streaming image data.
         """
-        try:
-            device = IMAQdx.IMAQdxCamera('cam%i' % self.device_id)
-            self.device = device
-            self.nodes = self.device.get_all_attributes().as_dict()
-        except:
-            error_check(801, currentframe())
-            return
+        raise NotImplementedError
 
-        # Send settings
-        self.device.enable_raw_readout("frame")
-        self.device.set_attribute_value("CameraAttributes/Exposure/Mode", "Manual")
-        self.device.set_attribute_value("AcquisitionAttributes/VideoMode", "1920x1520 MJPG 30.00fps")
-        self.device.set_roi((0, self.device.get_detector_size()[0], 0, self.device.get_detector_size()[1]))
-        # self.set_exposure(self.exposure_us)
-        # self.set_gamma(self.gamma)
-        # self.set_gain(self.gain)
+    def read_frame(self):
+        """
+        Wait for and grab the next frame from the camera. Backends may write the frame into self.ring.next_slot() to
+        avoid a copy when it is published, and record the "wait_for_frame" and "reformat" stages to self.stats.
+        :return: (np.array) RGB 8-bit image frame or None if no frame could be read.
+        """
+        raise NotImplementedError
 
-        self.start_stream()
+    def start_acquisition(self):
+        """
+        Start acquisition on the device (called from the stream thread).
+        """
+        pass
+
+    def stop_acquisition(self):
+        """
+        Stop acquisition on the device (called from the stream thread).
+        """
+        pass
+
+    def release(self):
+        """
+        Release the device handle.
+        """
+        pass
+
+    def is_in_range(self, setting, value):
+        """
+        Check a setting against the cached range of the device.
+        :param setting: (str) Options: 'exposure' [us], 'gamma' or 'gain'
+        :param value: (float) Value to check.
+        :return: (bool) True if the value is in range (or the device reports no range).
+        """
+        attr_min, attr_max = self.ranges.get(setting, (-np.inf, np.inf))
+        if attr_min <= float(value) <= attr_max:
+            return True
+        print(f"ERROR: Input out of range: [{attr_min}, {attr_max}]")
+
+        return False
 
     def set_exposure(self, new_value=None):
         """
         Set exposure time in microseconds.
         :param new_value: (float) Exposure time [us]
         """
-        if self.device is not None:
-            attr_min = self.nodes["CameraAttributes"]["Exposure"]["Value"].min
-            attr_max = self.nodes["CameraAttributes"]["Exposure"]["Value"].max
-            if attr_min <= (float(new_value) / 1e6) <= attr_max:
-                if new_value is not None:
-                    self.exposure_us = float(new_value)
-                self.exposure_us = float(self.exposure_us / 1e6)
-                self.device.set_attribute_value("CameraAttributes/Exposure/Value", self.exposure_us)
-            else:
-                print(f"ERROR: Input out of range: [{attr_min}, {attr_max}]")
+        if new_value is not None:
+            self.exposure_us = float(new_value)
 
     def set_gamma(self, new_value=None):
         """
-        Set gamma, or auto-gamma mode.
+        Set gamma.
         :param new_value: (float) Gamma value
         """
-        if self.device is not None:
-            attr_min = self.nodes["CameraAttributes"]["Gamma"]["Value"].min
-            attr_max = self.nodes["CameraAttributes"]["Gamma"]["Value"].max
-            if attr_min <= float(new_value) <= attr_max:
-                if new_value is not None:
-                    self.gamma = float(new_value)
-                self.device.set_attribute_value("CameraAttributes/Gamma/Value", self.gamma)
-            else:
-                print(f"ERROR: Input out of range: [{attr_min}, {attr_max}]")
+        if new_value is not None:
+            self.gamma = float(new_value)
 
     def set_gain(self, new_value=None):
-        # TODO: THIS ISN'T THE CORRECT GAIN
-        if self.device is not None:
-            attr_min = self.nodes["AcquisitionAttributes"]["Bayer"]["GainG"].min
-            attr_max = self.nodes["AcquisitionAttributes"]["Bayer"]["GainG"].max
-            if attr_min <= float(new_value) <= attr_max:
-                if new_value is not None:
-                    self.gain = float(new_value)
-                self.device.set_attribute_value("AcquisitionAttributes/Bayer/GainR", self.gain)
-                self.device.set_attribute_value("AcquisitionAttributes/Bayer/GainG", self.gain)
-                self.device.set_attribute_value("AcquisitionAttributes/Bayer/GainB", self.gain)
-            else:
-                print(f"ERROR: Input out of range: [{attr_min}, {attr_max}]")
+        """
+        Set gain.
+        :param new_value: (float) Gain value
+        """
+        if new_value is not None:
+            self.gain = float(new_value)
 
     def image_capture(self, save_path=""):
         """
@@ -122,7 +532,7 @@ class AmScopeCamNI:
             if save_path == "":
                 save_path = os.path.join(os.getcwd(), "captured_image.png")
             save_path = check_path(save_path)
-            img_16 = (self.current_frame.copy() * 256).astype('uint16')
+            img_16 = np.left_shift(self.current_frame, 8, dtype=np.uint16)
             cv2.imwrite(save_path, img_16)
             print("Saved image to:", save_path)
 
@@ -130,12 +540,14 @@ class AmScopeCamNI:
         """
         Stop stream and close device.
         """
+        self.auto_exposure.stop()
+        self.control.stop()
         if self.device is not None:
             if self.is_streaming:
                 self.stop_stream()
             while self.stream_thread.is_alive():
                 time.sleep(0.01)
-            self.device.close()
+            self.release()
 
     def start_stream(self):
         """
@@ -147,18 +559,22 @@ class AmScopeCamNI:
 
     def threaded_stream(self):
         """
-        Background thread for grabbing raw image data and assigning it to self.current_frame.
+        Background thread for grabbing image data, publishing it to the frame ring and assigning it to
+        self.current_frame.
         """
-        self.device.start_acquisition()
+        self.ring.reopen()
+        self.start_acquisition()
         while self.is_streaming:
-            self.device.wait_for_frame()
-            frame = self.device.read_oldest_image()
-            if frame is not None and frame.any():
-                self.current_frame = self.reformat_frame(frame)
+            frame = self.read_frame()
+            if frame is not None:
+                timestamp = time.perf_counter()
+                sequence = self.ring.publish(frame, timestamp, copy=not self.is_zero_copy)
+                self.current_frame = self.ring.read(sequence)[2]
+                self.stats.tick("acquired", timestamp)
             else:
-                error_check(802, currentframe())
                 break
-        self.device.stop_acquisition()
+        self.stop_acquisition()
+        self.ring.close()
         self.stream_thread = threading.Thread(target=self.threaded_stream, daemon=True)
 
     def stop_stream(self):
@@ -189,21 +605,362 @@ class AmScopeCamNI:
                     break
             cv2.destroyAllWindows()
 
+
+class AmScopeCamNI(Camera):
+
+    def open(self):
+        """
+        Initiate a connection to the available camera, set default settings, and start streaming image data.
+        """
+        try:
+            from pylablib.devices.IMAQdx import IMAQdx
+        except ImportError:
+            error_check(804, currentframe())
+            return
+        try:
+            device = IMAQdx.IMAQdxCamera('cam%i' % self.device_id)
+            self.device = device
+            self.nodes = self.device.get_all_attributes().as_dict()
+        except:
+            error_check(801, currentframe())
+            return
+        exposure = self.nodes["CameraAttributes"]["Exposure"]["Value"]
+        gamma = self.nodes["CameraAttributes"]["Gamma"]["Value"]
+        gain = self.nodes["AcquisitionAttributes"]["Bayer"]["GainG"]
+        self.ranges = {"exposure": (exposure.min * 1e6, exposure.max * 1e6), "gamma": (gamma.min, gamma.max),
+                       "gain": (gain.min, gain.max)}
+
+        # Send settings
+        self.device.enable_raw_readout("frame")
+        self.device.set_attribute_value("CameraAttributes/Exposure/Mode", "Manual")
+        self.set_video_mode("1920x1520 MJPG 30.00fps")
+        self.set_roi()
+        # self.set_exposure(self.exposure_us)
+        # self.set_gamma(self.gamma)
+        # self.set_gain(self.gain)
+
+        self.start_stream()
+
+    def set_exposure(self, new_value=None):
+        """
+        Set exposure time in microseconds.
+        :param new_value: (float) Exposure time [us]
+        """
+        if self.device is not None:
+            if new_value is None:
+                new_value = self.exposure_us
+            if self.is_in_range("exposure", new_value):
+                self.exposure_us = float(new_value)
+                self.device.set_attribute_value("CameraAttributes/Exposure/Value", self.exposure_us / 1e6)
+
+    def set_gamma(self, new_value=None):
+        """
+        Set gamma, or auto-gamma mode.
+        :param new_value: (float) Gamma value
+        """
+        if self.device is not None:
+            if new_value is None:
+                new_value = self.gamma
+            if self.is_in_range("gamma", new_value):
+                self.gamma = float(new_value)
+                self.device.set_attribute_value("CameraAttributes/Gamma/Value", self.gamma)
+
+    def set_gain(self, new_value=None):
+        # TODO: THIS ISN'T THE CORRECT GAIN
+        if self.device is not None:
+            if new_value is None:
+                new_value = self.gain
+            if self.is_in_range("gain", new_value):
+                self.gain = float(new_value)
+                self.device.set_attribute_value("AcquisitionAttributes/Bayer/GainR", self.gain)
+                self.device.set_attribute_value("AcquisitionAttributes/Bayer/GainG", self.gain)
+                self.device.set_attribute_value("AcquisitionAttributes/Bayer/GainB", self.gain)
+
+    def start_acquisition(self):
+        """
+        Start acquisition on the device (called from the stream thread).
+        """
+        self.device.start_acquisition()
+
+    def stop_acquisition(self):
+        """
+        Stop acquisition on the device (called from the stream thread).
+        """
+        self.device.stop_acquisition()
+
+    def release(self):
+        """
+        Release the device handle.
+        """
+        self.device.close()
+
+    def read_frame(self):
+        """
+        Wait for and grab the next raw frame from the camera.
+        :return: (np.array) RGB 8-bit image frame or None if no frame could be read.
+        """
+        with self.stats.timer("wait_for_frame"):
+            self.device.wait_for_frame()
+            frame = self.device.read_oldest_image()
+        if frame is not None and frame.any():
+            with self.stats.timer("reformat"):
+                return self.reformat_frame(frame)
+        error_check(802, currentframe())
+
+    def set_video_mode(self, video_mode):
+        """
+        Set the video mode (resolution, format and frame rate) and invalidate the cached frame geometry.
+        :param video_mode: (str) IMAQdx video mode, e.g. '1920x1520 MJPG 30.00fps'.
+        """
+        if self.device is not None:
+            self.device.set_attribute_value("AcquisitionAttributes/VideoMode", video_mode)
+            self.frame_size = None
+
+    def set_roi(self, roi=None):
+        """
+        Set the region of interest and invalidate the cached frame geometry.
+        :param roi: (int tuple) (hstart, hend, vstart, vend). Default: full detector.
+        """
+        if self.device is not None:
+            if roi is None:
+                roi = (0, self.device.get_detector_size()[0], 0, self.device.get_detector_size()[1])
+            self.device.set_roi(roi)
+            self.frame_size = None
+
     def reformat_frame(self, frame):
+        """
+        Convert a raw RGBA frame into an RGB 8-bit image, written straight into the next slot of the frame ring.
+        :param frame: (np.array) Raw frame readout (interleaved RGBA bytes).
+        :return: (np.array) RGB 8-bit image frame.
+        """
         if self.device is not None:
-            width = self.device.get_attribute_value("AcquisitionAttributes/Width")
-            height = self.device.get_attribute_value("AcquisitionAttributes/Height")
+            # Frame geometry is only read from the driver after open, a video mode or ROI change, or a size mismatch
+            if self.frame_size is None or frame.size != self.frame_size[0] * self.frame_size[1] * 4:
+                self.frame_size = (self.device.get_attribute_value("AcquisitionAttributes/Width"),
+                                   self.device.get_attribute_value("AcquisitionAttributes/Height"))
+            width, height = self.frame_size
 
-            red = frame[0::4].reshape(height, width)
-            green = frame[1::4].reshape(height, width)
-            blue = frame[2::4].reshape(height, width)
-            alpha = frame[3::4].reshape(height, width)
-            rgba = np.dstack((red, green, blue, alpha))
-            rgb = cv2.cvtColor(rgba, cv2.COLOR_RGBA2RGB)
+            rgba = frame.reshape(height, width, 4)
+            rgb = cv2.cvtColor(rgba, cv2.COLOR_RGBA2RGB, dst=self.ring.next_slot((height, width, 3)))
 
             return rgb
 
 
+class OpenCVCam(Camera):
+
+    def open(self):
+        """
+        Open an OpenCV VideoCapture device (webcams, capture cards and video files), set the requested resolution
+        and frame rate, and start streaming image data.
+        """
+        source = self.settings.get("Source", self.device_id)
+        device = cv2.VideoCapture(source)
+        if not device.isOpened():
+            error_check(811, currentframe())
+            return
+        self.device = device
+
+        # Send settings (ignored by devices that do not support them)
+        if "Resolution" in self.settings:
+            self.device.set(cv2.CAP_PROP_FRAME_WIDTH, self.settings["Resolution"][0])
+            self.device.set(cv2.CAP_PROP_FRAME_HEIGHT, self.settings["Resolution"][1])
+        if "FPS" in self.settings:
+            self.device.set(cv2.CAP_PROP_FPS, self.settings["FPS"])
+
+        self.start_stream()
+
+    def set_exposure(self, new_value=None):
+        """
+        Set exposure time in microseconds. The unit of CAP_PROP_EXPOSURE depends on the capture driver, so the value
+        is multiplied by "Exposure Scale" from the settings (default: seconds).
+        :param new_value: (float) Exposure time [us]
+        """
+        if self.device is not None:
+            if new_value is not None:
+                self.exposure_us = float(new_value)
+            if not self.device.set(cv2.CAP_PROP_EXPOSURE, self.exposure_us * self.settings.get("Exposure Scale", 1e-6)):
+                print("ERROR: Exposure is not supported by this device")
+
+    def set_gamma(self, new_value=None):
+        """
+        Set gamma.
+        :param new_value: (float) Gamma value
+        """
+        if self.device is not None:
+            if new_value is not None:
+                self.gamma = float(new_value)
+            if not self.device.set(cv2.CAP_PROP_GAMMA, self.gamma):
+                print("ERROR: Gamma is not supported by this device")
+
+    def release(self):
+        """
+        Release the device handle.
+        """
+        self.device.release()
+
+    def read_frame(self):
+        """
+        Wait for and grab the next frame from the device.
+        :return: (np.array) RGB 8-bit image frame or None if no frame could be read.
+        """
+        with self.stats.timer("wait_for_frame"):
+            is_read, frame = self.device.read()
+        if not is_read or frame is None:
+            error_check(812, currentframe())
+            return None
+        with self.stats.timer("reformat"):
+            slot = self.ring.next_slot(frame.shape[:2] + (3,))
+            if len(frame.shape) == 2:
+                return cv2.cvtColor(ip.convert_color_bit(frame, "mono", 8), cv2.COLOR_GRAY2RGB, dst=slot)
+
+            return cv2.cvtColor(ip.convert_color_bit(frame, "rgb", 8), cv2.COLOR_BGR2RGB, dst=slot)
+
+
+class SyntheticCam(Camera):
+
+    def open(self):
+        """
+        Set up a simulated camera that renders blobs moving on circular paths over a noisy background. Frames are
+        deterministic: frame n is always the same image for the same settings, exposure and gamma.
+        """
+        width, height = self.settings.get("Resolution", [1920, 1520])
+        self.shape = (height, width)
+        self.fps = float(self.settings.get("FPS", 30))
+        self.radius = self.settings.get("Radius", 18)
+        self.noise = self.settings.get("Noise", 10)
+        self.seed = self.settings.get("Seed", 0)
+        self.frame_count = 0
+        self.next_frame_time = 0
+
+        # Blob path centers, path radius and phase
+        n_blobs = self.settings.get("Blobs", 1)
+        rng = np.random.default_rng(self.seed)
+        self.paths = np.column_stack((rng.uniform(0.3 * width, 0.7 * width, n_blobs),
+                                      rng.uniform(0.3 * height, 0.7 * height, n_blobs),
+                                      rng.uniform(0.05, 0.15, n_blobs) * min(width, height),
+                                      rng.uniform(0, 2 * math.pi, n_blobs)))
+        if n_blobs == 1:
+            self.paths[0, :2] = (width / 2, height / 2)
+        self.ranges = {"exposure": (10, 10000000), "gamma": (0.1, 10), "gain": (0, 0)}
+        self.device = self  # no device handle; frames are rendered in read_frame()
+
+        self.start_stream()
+
+    def start_acquisition(self):
+        """
+        Start the frame clock (called from the stream thread).
+        """
+        self.next_frame_time = time.perf_counter()
+
+    def read_frame(self):
+        """
+        Wait for the next frame period and render the frame (recorded as the "reformat" stage).
+        :return: (np.array) RGB 8-bit image frame.
+        """
+        # Pace frames to the configured frame rate (restart the clock if the consumer fell behind)
+        with self.stats.timer("wait_for_frame"):
+            delay = self.next_frame_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self.next_frame_time = max(self.next_frame_time, time.perf_counter() - 1 / self.fps) + 1 / self.fps
+
+        # Blobs move one revolution every 10 s; brightness follows exposure and gamma (default exposure = level 230)
+        with self.stats.timer("reformat"):
+            angle = 2 * math.pi * self.frame_count / (10 * self.fps) + self.paths[:, 3]
+            centers = np.column_stack((self.paths[:, 0] + self.paths[:, 2] * np.cos(angle),
+                                       self.paths[:, 1] + self.paths[:, 2] * np.sin(angle)))
+            level = 255 * min(230 / 255 * self.exposure_us / 200000, 1) ** (1 / max(self.gamma, 0.01))
+            frame = ip.synthetic_frame(self.shape, centers, radius=self.radius, level=int(level), noise=self.noise,
+                                       seed=self.seed + self.frame_count)
+        self.frame_count += 1
+
+        return frame
+
+
+class ReplayCam(Camera):
+
+    def open(self):
+        """
+        Open a recorded session (see recording.FrameRecorder) and start streaming its frames, either at the recorded
+        timing ("Realtime" = 1, scaled by "Speed") or as fast as the consumer handles them ("Realtime" = 0; every
+        frame is shown, none are dropped). Frames are served zero-copy from the memory-mapped chunk files.
+        """
+        try:
+            self.recording = rec.Recording(self.settings.get("Session", ""))
+        except (OSError, ValueError, KeyError):
+            error_check(821, currentframe())
+            return
+        if not len(self.recording):
+            error_check(821, currentframe())
+            return
+        self.is_realtime = bool(self.settings.get("Realtime", 1))
+        self.is_loop = bool(self.settings.get("Loop", 1))
+        self.speed = float(self.settings.get("Speed", 1.0))
+        self.frame_num = 0
+        self.clock = None  # (perf_counter, recorded timestamp) pair the recorded timing is replayed against
+        self.is_paused = False
+        self.is_seeked = False
+        self.wake = threading.Event()  # set on seek and resume, so a paused replay sleeps instead of polling
+        self.is_zero_copy = True
+        self.device = self.recording
+
+        self.start_stream()
+
+    def seek(self, frame_num):
+        """
+        Jump to a recorded frame. While paused, the frame is still shown once.
+        :param frame_num: (int) Frame number (0 = first recorded frame).
+        """
+        if self.device is not None:
+            self.frame_num = min(max(int(frame_num), 0), len(self.recording) - 1)
+            self.is_seeked = True
+            self.wake.set()
+
+    def pause(self, is_paused=True):
+        """
+        Pause or resume the replay.
+        :param is_paused: (bool) Pause?
+        """
+        self.is_paused = is_paused
+        self.clock = None
+        self.wake.set()
+
+    def read_frame(self):
+        """
+        Wait until the next recorded frame is due and serve it without copying.
+        :return: (np.array) Read-only image frame or None at the end of a recording that does not loop.
+        """
+        with self.stats.timer("wait_for_frame"):
+            while self.is_streaming and self.is_paused and not self.is_seeked:
+                self.wake.wait(0.25)
+                self.wake.clear()
+            if self.frame_num >= len(self.recording):
+                if not self.is_loop:
+                    error_check(822, currentframe())
+                    return None
+                self.frame_num = 0
+                self.clock = None
+
+            # Replay at the recorded timing, or in lockstep with the consumer
+            timestamp = self.recording.index["timestamp"][self.frame_num]
+            if self.is_realtime:
+                if self.clock is None or self.is_seeked:
+                    self.clock = (time.perf_counter(), timestamp)
+                delay = self.clock[0] + (timestamp - self.clock[1]) / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                self.ring.wait_until_read(self.ring.sequence, timeout=0.5)
+
+        frame = self.recording.frame(self.frame_num)
+        self.exposure_us = float(self.recording.index["exposure_us"][self.frame_num])
+        self.gamma = float(self.recording.index["gamma"][self.frame_num])
+        self.frame_num += 1
+        self.is_seeked = False
+
+        return frame
+
+
 if __name__ == "__main__":
     cam_id = 2
     dev = AmScopeCamNI(device_id=cam_id)
@@ -1,44 +1,674 @@
 # -*- coding: utf-8 -*-
 
-import cv2, os, json, math
+import cv2, os, json, math, threading
 import numpy as np
-import circle_fit
+from types import MappingProxyType
+from collections import namedtuple
 
-# Open gui_settings.json file to be used for defaults
-try:
-    with open(os.path.join(os.getcwd(), "blob_detection\\support\\gui_settings.json")) as f:
-        json_settings = json.load(f)
-except FileNotFoundError:
-    with open(os.path.join(os.getcwd(), "..\\blob_detection\\support\\gui_settings.json")) as f:
-        json_settings = json.load(f)
+# Open gui_settings.json file to be used for defaults (found next to the package, whatever the working directory)
+SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "support", "gui_settings.json")
+with open(SETTINGS_PATH) as f:
+    json_settings = json.load(f)
 
+# Reusable output buffers of convert_color_bit (one pool per thread)
+frame_buffers = threading.local()
 
-def convert_color_bit(image_array, color, bit_depth):
+# Immutable snapshot of the detection settings with derived values precomputed (see make_detection_config)
+DetectionConfig = namedtuple("DetectionConfig", ["threshold", "contour_limits", "circle_limits", "fit_circle",
+                                                 "tracking", "pyramid", "poly_fit", "gauss", "gauss_kernel", "pad",
+                                                 "pyramid_gauss", "pyramid_limits", "max_radius", "feature_size",
+                                                 "crosshairs", "saturation_stride", "colors"])
+# Overlay colors (RGB) of draw_blobs and the stream cross-hairs
+OVERLAY_COLORS = MappingProxyType({"blob": (255, 0, 0), "zero": (0, 255, 0), "measured": (0, 0, 255),
+                                   "crosshairs": (0, 0, 0)})
+
+
+def get_buffer(name, shape, dtype):
+    """
+    Get a reusable output buffer. Buffers are kept per thread and per name, and are only reallocated when the
+    requested shape or dtype changes.
+    :param name: (str) Name of the buffer (one buffer is kept per name).
+    :param shape: (int tuple) Shape of the buffer.
+    :param dtype: (np.dtype) Data type of the buffer.
+    :return: (np.array) Uninitialized buffer.
+    """
+    if not hasattr(frame_buffers, "pool"):
+        frame_buffers.pool = {}
+    buffer = frame_buffers.pool.get(name)
+    if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+        buffer = np.empty(shape, dtype)
+        frame_buffers.pool[name] = buffer
+
+    return buffer
+
+
+def convert_color_bit(image_array, color, bit_depth, buffer=None):
     """
-    Convert input image array into the specified color and bit-depth.
+    Convert input image array into the specified color and bit-depth. The input array is never modified.
     :param image_array: (np.array) Image array to convert.
     :param color: (str) Options: 'rgb' or 'mono'
     :param bit_depth: (int/str) Options: 8 or 16
+    :param buffer: (str) Name of a reusable buffer to write the result into (see get_buffer). The result is then never
+                   the input array and stays valid until the next conversion into the same buffer on this thread.
+                   Default: allocate the result (or return the input array if it is already in the right format).
     :return: (np.array) Converted image array.
     """
-    if image_array.any():
-        # Check bit depth and convert
+    if image_array.size:
+        # Check bit depth and color
         current_bd = image_array.dtype.name
+        to_dtype = None
         if "8" in str(bit_depth) and "8" not in current_bd:  # 16-bit to 8-bit
-            image_array = (image_array / 256).astype('uint8')
+            to_dtype = np.uint8
         elif "16" in str(bit_depth) and "16" not in current_bd:  # 8-bit to 16-bit
-            image_array = (image_array * 256).astype('uint16')
-
-        # Check color and convert
+            to_dtype = np.uint16
         s = image_array.shape
+        to_color = None
         if len(s) == 2 and "rgb" in color.lower():
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
+            to_color, color_shape = cv2.COLOR_GRAY2RGB, s + (3,)
         elif len(s) == 3 and "mono" in color.lower():
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
+            to_color, color_shape = cv2.COLOR_RGB2GRAY, s[:2]
+
+        # Convert bit depth with integer shifts
+        if to_dtype is not None:
+            if buffer is None:
+                converted = np.empty(s, to_dtype)
+            else:
+                converted = get_buffer(buffer if to_color is None else buffer + " depth", s, to_dtype)
+            if current_bd == "uint16":
+                np.right_shift(image_array, 8, out=converted, casting="unsafe")
+            elif current_bd == "uint8":
+                np.left_shift(image_array, 8, out=converted, dtype=np.uint16)
+            elif to_dtype == np.uint8:
+                np.floor_divide(image_array, 256, out=converted, casting="unsafe")
+            else:
+                np.multiply(image_array, 256, out=converted, casting="unsafe")
+            image_array = converted
+
+        # Convert color
+        if to_color is not None:
+            dst = None if buffer is None else get_buffer(buffer, color_shape, image_array.dtype)
+            image_array = cv2.cvtColor(image_array, to_color, dst=dst)
+        elif to_dtype is None and buffer is not None:
+            copied = get_buffer(buffer, s, image_array.dtype)
+            np.copyto(copied, image_array)
+            image_array = copied
 
         return image_array
 
 
+def make_detection_config(detection_settings=None, **changes):
+    """
+    Make a frozen snapshot of the detection settings. Everything derived from them (blur kernel, search padding,
+    pyramid limits) is computed once here, so the stream reads one object per frame instead of widgets and dicts; a
+    changed setting is published as a new snapshot.
+    :param detection_settings: (dict) "Detection" section of the config. Default: gui_settings.json.
+    :param changes: Settings that differ from the config, by DetectionConfig field name (e.g. threshold=120). None
+                    values are ignored.
+    :return: (DetectionConfig) Settings snapshot.
+    """
+    settings = json_settings["Detection"] if detection_settings is None else detection_settings
+    changes = {key: value for key, value in changes.items() if value is not None}
+    gauss = int(changes.get("gauss", settings["Gaussian"]))
+    contour_limits = tuple(changes.get("contour_limits", settings["Contours"]))
+    pyramid = 2 ** int(math.log2(max(int(changes.get("pyramid", settings.get("Pyramid", 1))), 1)))
+
+    return DetectionConfig(threshold=int(changes.get("threshold", settings["Threshold"])),
+                           contour_limits=contour_limits,
+                           circle_limits=tuple(changes.get("circle_limits", settings["Circularity"])),
+                           fit_circle=bool(changes.get("fit_circle", settings.get("Circle Fit", 0))),
+                           tracking=bool(changes.get("tracking", settings.get("Tracking", 0))),
+                           pyramid=pyramid, poly_fit=changes.get("poly_fit", settings["Poly Fit"]), gauss=gauss,
+                           gauss_kernel=(gauss, gauss), pad=gauss // 2 + 1,
+                           pyramid_gauss=max(gauss // pyramid, 1) | 1,
+                           pyramid_limits=(contour_limits[0] / 2, contour_limits[1] * 2),
+                           max_radius=math.sqrt(contour_limits[1] / math.pi),
+                           feature_size=int(changes.get("feature_size", settings["Feature Size"])),
+                           crosshairs=bool(changes.get("crosshairs", False)),
+                           saturation_stride=int(changes.get("saturation_stride",
+                                                             settings.get("Saturation Stride", 1))),
+                           colors=OVERLAY_COLORS)
+
+
+class FrameContext:
+
+    def __init__(self, image_array, sequence=0):
+        """
+        Derived views of one captured frame. Each view is computed on first use and shared by every consumer of the
+        frame (saturation, detection, display), so a frame is converted at most once per view.
+        :param image_array: (np.array) Captured image frame (never modified).
+        :param sequence: (int) Sequence number of the frame the views belong to.
+        """
+        self.image_array = image_array
+        self.sequence = sequence
+        self.views = {}
+        self.lock = threading.RLock()
+
+    def get_view(self, key, make_view):
+        """
+        Get a memoized view, computing it if this is the first request.
+        :param key: (tuple) Name and parameters of the view.
+        :param make_view: (function) Computes the view when it is not cached yet.
+        :return: (np.array) Derived view. Consumers must not modify it.
+        """
+        with self.lock:
+            if key not in self.views:
+                self.views[key] = make_view()
+            return self.views[key]
+
+    def mono8(self):
+        """
+        Get the 8-bit mono view.
+        """
+        return self.get_view(("mono8",), lambda: convert_color_bit(self.image_array, "mono", 8))
+
+    def mono16(self):
+        """
+        Get the 16-bit mono view.
+        """
+        return self.get_view(("mono16",), lambda: convert_color_bit(self.image_array, "mono", 16))
+
+    def rgb8(self):
+        """
+        Get the 8-bit RGB view.
+        """
+        return self.get_view(("rgb8",), lambda: convert_color_bit(self.image_array, "rgb", 8))
+
+    def blurred(self, gauss=None):
+        """
+        Get the Gaussian blurred 8-bit mono view.
+        :param gauss: (int) Gaussian kernel size. Default: config value.
+        :return: (np.array) Blurred view.
+        """
+        if gauss is None:
+            gauss = json_settings["Detection"]["Gaussian"]
+        return self.get_view(("blurred", gauss), lambda: cv2.GaussianBlur(self.mono8(), (gauss, gauss), 1))
+
+    def threshold_mask(self, threshold, gauss=None):
+        """
+        Get the binary mask of the blurred view.
+        :param threshold: (int) Lower threshold value for cv2.threshold.
+        :param gauss: (int) Gaussian kernel size. Default: config value.
+        :return: (np.array) Threshold mask (0 or 255).
+        """
+        if gauss is None:
+            gauss = json_settings["Detection"]["Gaussian"]
+        return self.get_view(("threshold", threshold, gauss),
+                             lambda: cv2.threshold(self.blurred(gauss), threshold, 255, cv2.THRESH_BINARY)[1])
+
+    def histogram(self, stride=1):
+        """
+        Get the histogram of the mono view at the frame's native bit depth.
+        :param stride: (int) Only count every stride-th pixel in each direction (fast preview).
+        :return: (np.array) Pixel count per level (256 bins for 8-bit frames, 65536 otherwise).
+        """
+        def make_histogram():
+            bit_depth = 8 if self.image_array.dtype == np.uint8 else 16
+            if stride > 1:
+                # Nearest-neighbour resize picks every stride-th pixel into a contiguous array (a strided view would
+                # be copied by OpenCV first)
+                h, w = self.image_array.shape[:2]
+                sample = cv2.resize(self.image_array, (-(-w // stride), -(-h // stride)),
+                                    interpolation=cv2.INTER_NEAREST)
+                mono = convert_color_bit(sample, "mono", bit_depth)
+            else:
+                mono = self.mono8() if bit_depth == 8 else self.mono16()
+            levels = 2 ** bit_depth
+            return cv2.calcHist([mono], [0], None, [levels], [0, levels]).ravel().astype(np.int64)
+
+        return self.get_view(("histogram", stride), make_histogram)
+
+
+def measure_saturation(histogram):
+    """
+    Rate the saturation of a frame from its histogram. Levels are reported on a 16-bit scale for any bit depth.
+    :param histogram: (np.array) Pixel count per level (256 bins for 8-bit frames, 65536 for 16-bit frames).
+    :return: (dict) 'level' ('LOW', 'GOOD' or 'HIGH'), 'saturation' (% of pixels above 95% of full scale), 'mean'
+             (mean level) and 'percentiles' (level at the 1st, 50th, 95th, 99th and 99.9th percentile, in steps of 256).
+    """
+    total_pixels = int(histogram.sum())
+    scale = 2 ** 16 // len(histogram)
+    if total_pixels == 0:
+        return {"level": "LOW", "saturation": 0, "mean": 0, "percentiles": {1: 0, 50: 0, 95: 0, 99: 0, 99.9: 0}}
+
+    # Count pixels above the low (50%) and high (95%) limits, starting from the first bin that reaches them
+    sat_limits = [int((2 ** 16 - 256) * 0.50), int((2 ** 16 - 256) * 0.95)]  # low: 50%, high: 95%
+    sat_threshold = round(0.001 * total_pixels)  # typically 0.00001 not 0.001
+    above_low, above_high = [int(histogram[-(-limit // scale):].sum()) for limit in sat_limits]
+    is_low_sat = above_low <= sat_threshold
+    is_high_sat = not is_low_sat and above_high >= sat_threshold
+    if is_high_sat:
+        level = "HIGH"
+    elif is_low_sat:
+        level = "LOW"
+    else:
+        level = "GOOD"
+
+    # Statistics of the light level; percentiles are read from a 256-bin fold (steps of 1/256 of full scale), so a
+    # 16-bit histogram costs about as much as an 8-bit one
+    folded = histogram.reshape(256, -1).sum(axis=1) if len(histogram) > 256 else histogram
+    cumulative = np.cumsum(folded)
+    percentiles = {p: int(np.searchsorted(cumulative, total_pixels * p / 100)) * 256 for p in (1, 50, 95, 99, 99.9)}
+    mean = float(np.dot(histogram, np.arange(len(histogram), dtype=np.int64))) * scale / total_pixels
+
+    return {"level": level, "saturation": above_high / total_pixels * 100, "mean": mean, "percentiles": percentiles}
+
+
+def contour_areas(contours):
+    """
+    Calculate the enclosed area of every contour in one pass (shoelace formula over the concatenated points).
+    :param contours: (np.array list) Contours from cv2.findContours.
+    :return: (np.array) Area of each contour, same as cv2.contourArea.
+    """
+    if len(contours) == 0:
+        return np.zeros(0)
+    lengths = np.fromiter(map(len, contours), dtype=np.intp, count=len(contours))
+    starts = np.cumsum(lengths) - lengths
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    following = np.roll(points, -1, axis=0)
+    following[starts + lengths - 1] = points[starts]
+    cross = points[:, 0] * following[:, 1] - following[:, 0] * points[:, 1]
+
+    return np.abs(np.add.reduceat(cross, starts)) / 2
+
+
+def fit_circles(point_sets, iterations=5):
+    """
+    Fit a circle to every set of points in one vectorized solve: Kasa algebraic fit, optionally refined towards the
+    geometric (least squares distance) fit with Gauss-Newton iterations.
+    :param point_sets: (np.array list) Nx2 point arrays, one per candidate.
+    :param iterations: (int) Number of geometric refinement iterations; 0 returns the algebraic fit.
+    :return: (np.array) One row of (xc, yc, radius, rms residual) per point set; NaN where no circle could be fit.
+    """
+    lengths = np.fromiter(map(len, point_sets), dtype=np.intp, count=len(point_sets))
+    if not (lengths > 0).all():  # empty sets cannot be reduced; fit the rest and leave those as NaN
+        circles = np.full((len(point_sets), 4), np.nan)
+        circles[lengths > 0] = fit_circles([points for points in point_sets if len(points)], iterations=iterations)
+        return circles
+    if len(point_sets) == 0:
+        return np.zeros((0, 4))
+    starts = np.cumsum(lengths) - lengths
+    segment = np.repeat(np.arange(len(point_sets)), lengths)
+    points = np.concatenate(point_sets).reshape(-1, 2).astype(np.float64)
+
+    # Work relative to each set's mean for numerical stability
+    means = np.add.reduceat(points, starts, axis=0) / lengths[:, None]
+    x, y = (points - means[segment]).T
+    z = x * x + y * y
+
+    # Algebraic fit: solve x^2 + y^2 + Dx + Ey + F = 0 in the least squares sense
+    sums = np.add.reduceat(np.stack([x * x, x * y, x, y * y, y, x * z, y * z, z], axis=1), starts, axis=0)
+    normal = np.stack([sums[:, 0], sums[:, 1], sums[:, 2], sums[:, 1], sums[:, 3], sums[:, 4], sums[:, 2],
+                       sums[:, 4], lengths], axis=1).reshape(-1, 3, 3)
+    d, e, f = _solve_batched(normal, -sums[:, 5:8]).T
+    a, b = -d / 2, -e / 2
+    r = np.sqrt(np.maximum(a * a + b * b - f, 0))
+
+    # Geometric refinement: Gauss-Newton on the distance residuals of all circles at once
+    for _ in range(iterations):
+        dx, dy = x - a[segment], y - b[segment]
+        dist = np.maximum(np.hypot(dx, dy), 1e-12)
+        residual = dist - r[segment]
+        jacobian = np.stack([-dx / dist, -dy / dist, -np.ones_like(dist)], axis=1)
+        jtj = np.add.reduceat(jacobian[:, :, None] * jacobian[:, None, :], starts, axis=0)
+        jtr = np.add.reduceat(jacobian * residual[:, None], starts, axis=0)
+        step = _solve_batched(jtj, -jtr)
+        a, b, r = a + step[:, 0], b + step[:, 1], r + step[:, 2]
+
+    residual = np.hypot(x - a[segment], y - b[segment]) - r[segment]
+    rms = np.sqrt(np.add.reduceat(residual * residual, starts) / lengths)
+
+    return np.stack([a + means[:, 0], b + means[:, 1], np.abs(r), rms], axis=1)
+
+
+def _solve_batched(matrices, vectors):
+    """
+    Solve a stack of 3x3 linear systems, returning NaN for the singular ones instead of raising.
+    :param matrices: (np.array) Kx3x3 system matrices.
+    :param vectors: (np.array) Kx3 right-hand sides.
+    :return: (np.array) Kx3 solutions.
+    """
+    is_solvable = np.isfinite(matrices).all(axis=(1, 2))
+    is_solvable[is_solvable] = np.abs(np.linalg.det(matrices[is_solvable])) > 1e-9
+    solutions = np.full(vectors.shape, np.nan)
+    if is_solvable.any():
+        solutions[is_solvable] = np.linalg.solve(matrices[is_solvable], vectors[is_solvable][..., None])[..., 0]
+
+    return solutions
+
+
+def measure_blobs(image_array, threshold=None, contour_limits=None, circle_limits=None, fit_circle=False, roi=None,
+                  pyramid=None, context=None, config=None):
+    """
+    Measure every blob in image array that passes the detection limits (no drawing).
+    :param image_array: (np.array) Image array to measure.
+    :param threshold: (int) Lower threshold value for cv2.threshold.
+    :param contour_limits: (int list) Lower and upper bounds for area size of found blob.
+    :param circle_limits: (float list) Lower and upper bounds for circularity of found blob.
+    :param fit_circle: (bool) Fit a least squares circle to found blob?
+    :param roi: (int tuple) Only search within this (x, y, w, h) window. Results are still in full-frame coordinates.
+    :param pyramid: (int) Find candidates on an image downsampled by this factor (2 or 4), then measure them on
+                    full-resolution windows. 1 = search at full resolution only.
+    :param context: (FrameContext) Shared views of image_array; its threshold mask is reused for full-frame searches.
+    :param config: (DetectionConfig) Settings snapshot; replaces threshold, contour_limits, circle_limits, fit_circle
+                   and pyramid. Default: made from these arguments and the config file.
+    :return: (dict list) One dict per accepted blob with keys: 'center' (float tuple), 'area', 'perimeter',
+             'circularity', 'radius' (fitted radius, or equivalent radius if not fit), 'residual' (rms circle fit
+             residual or None), 'bbox' (x, y, w, h), 'contour' (poly fit points) and 'fit' ('circle' or 'moments').
+    """
+    # Define local variables
+    blobs = []
+    if config is None:
+        config = make_detection_config(threshold=threshold, contour_limits=contour_limits,
+                                       circle_limits=circle_limits, fit_circle=fit_circle, pyramid=pyramid)
+    threshold, contour_limits, circle_limits = config.threshold, config.contour_limits, config.circle_limits
+    if config.pyramid > 1 and roi is None:
+        return measure_blobs_pyramid(image_array, config)
+
+    # Baseline image data
+    offset = (0, 0)
+    if roi is not None:
+        offset = (roi[0], roi[1])
+        image_array = image_array[roi[1]:roi[1] + roi[3], roi[0]:roi[0] + roi[2]]
+    if context is not None and roi is None and image_array.size:
+        thresh = context.threshold_mask(threshold, config.gauss)
+    else:
+        image_grey8 = convert_color_bit(image_array, "mono", 8, buffer="detect" if roi is None else None)
+        if image_grey8 is None:
+            return blobs
+        image_gauss = cv2.GaussianBlur(image_grey8, config.gauss_kernel, 1)
+        ret, thresh = cv2.threshold(image_gauss, threshold, 255, cv2.THRESH_BINARY)
+    contours_found, hierarchy = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=offset)
+
+    # Filter every contour against the limits at once; only the survivors are measured individually
+    areas = contour_areas(contours_found)
+    candidates = np.flatnonzero((contour_limits[0] < areas) & (areas < contour_limits[1]))
+    perimeters = np.array([cv2.arcLength(contours_found[i], True) for i in candidates])
+    circularities = np.divide(4 * math.pi * areas[candidates], perimeters * perimeters,
+                              out=np.zeros(len(candidates)), where=perimeters > 0)
+    is_blob = perimeters > 0
+    if config.fit_circle:  # if the blob is expected to be circular
+        is_blob &= (circle_limits[0] < circularities) & (circularities < circle_limits[1])
+
+    # Measure accepted blobs, fitting circles to all of them at once
+    accepted, perimeters, circularities = candidates[is_blob], perimeters[is_blob], circularities[is_blob]
+    approxes = [cv2.approxPolyDP(contours_found[i], config.poly_fit, True) for i in accepted]
+    if config.fit_circle:
+        circles = fit_circles([approx[:, 0, :] for approx in approxes])
+    for j, i in enumerate(accepted):
+        contour, area = contours_found[i], float(areas[i])
+        if config.fit_circle:
+            xc, yc, rc, sig = circles[j]
+            if not np.isfinite(sig):
+                continue
+            center, radius, residual, fit = (xc, yc), rc, sig, "circle"
+        else:
+            moment = cv2.moments(contour)
+            center = (moment["m10"] / moment["m00"], moment["m01"] / moment["m00"])
+            radius, residual, fit = math.sqrt(area / math.pi), None, "moments"
+
+        blobs.append({"center": center, "area": area, "perimeter": float(perimeters[j]),
+                      "circularity": float(circularities[j]), "radius": radius, "residual": residual,
+                      "bbox": cv2.boundingRect(contour), "contour": approxes[j], "fit": fit})
+
+    return blobs
+
+
+def measure_blobs_pyramid(image_array, config):
+    """
+    Find candidate blobs on a downsampled image, then measure each candidate on a full-resolution window around it.
+    :param image_array: (np.array) Image array to measure.
+    :param config: (DetectionConfig) Settings snapshot (config.pyramid is the downsampling factor, a power of 2).
+    :return: (dict list) Output of measure_blobs, measured at full resolution.
+    """
+    scale = config.pyramid
+
+    # Find candidates on the downsampled image with scaled (and relaxed) limits
+    s = image_array.shape
+    image_small = image_array
+    for level in range(int(math.log2(scale))):  # repeated halving is much faster than one large INTER_AREA step
+        image_small = cv2.resize(image_small, (image_small.shape[1] // 2, image_small.shape[0] // 2),
+                                 interpolation=cv2.INTER_AREA)
+    image_small = convert_color_bit(image_small, "mono", 8)
+    if image_small is None:
+        return []
+    image_gauss = cv2.GaussianBlur(image_small, (config.pyramid_gauss, config.pyramid_gauss), 1 / scale)
+    ret, thresh = cv2.threshold(image_gauss, config.threshold, 255, cv2.THRESH_BINARY)
+    contours_found, hierarchy = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    areas = contour_areas(contours_found) * scale * scale
+    candidates = np.flatnonzero((config.pyramid_limits[0] < areas) & (areas < config.pyramid_limits[1]))
+
+    # Measure each candidate at full resolution
+    blobs, bboxes = [], set()
+    pad = config.gauss + 2 * scale
+    for i in candidates:
+        x, y, w, h = cv2.boundingRect(contours_found[i])
+        x0, y0 = max(x * scale - pad, 0), max(y * scale - pad, 0)
+        x1, y1 = min((x + w) * scale + pad, s[1]), min((y + h) * scale + pad, s[0])
+        window = (x0, y0, x1 - x0, y1 - y0)
+        for blob in measure_blobs(image_array, roi=window, config=config):
+            if not is_inside_window(blob["bbox"], window, s, config.pad):  # larger than its candidate; search in full
+                return measure_blobs(image_array, config=config._replace(pyramid=1))
+            if blob["bbox"] not in bboxes:
+                bboxes.add(blob["bbox"])
+                blobs.append(blob)
+
+    # Return the blobs in the order of a full-resolution search (cv2.findContours lists outer contours from the bottom
+    # up by their top row), so blob_center reports the same blob; the coarse contours are only ordered by coarse row
+    blobs.sort(key=lambda blob: (blob["bbox"][1], blob["bbox"][0]), reverse=True)
+
+    return blobs
+
+
+def is_inside_window(bbox, window, image_shape, pad=None):
+    """
+    Check that a blob found in a search window is clear of the window edges (so it was not cut off or blurred).
+    :param bbox: (int tuple) Bounding box (x, y, w, h) of the blob.
+    :param window: (int tuple) Search window (x, y, w, h).
+    :param image_shape: (int tuple) Shape of the full image array.
+    :param pad: (int) Required clearance [pxl] (DetectionConfig.pad). Default: from the config file.
+    :return: (bool) True if the blob is fully inside the window.
+    """
+    x, y, w, h = window
+    if pad is None:
+        pad = json_settings["Detection"]["Gaussian"] // 2 + 1
+    bx, by, bw, bh = bbox
+    if x > 0 and bx - pad < x or y > 0 and by - pad < y:
+        return False
+    if x + w < image_shape[1] and bx + bw + pad > x + w or y + h < image_shape[0] and by + bh + pad > y + h:
+        return False
+
+    return True
+
+
+class BlobTracker:
+
+    def __init__(self, margin=3.0):
+        """
+        Track a blob between frames by only searching a window around its last known center.
+        :param margin: (float) Half-size of the search window in multiples of the largest allowed blob radius.
+        """
+        self.margin = margin
+        self.last_center = None
+        self.window = None
+
+    def reset(self):
+        """
+        Forget the last known blob so the next frame is searched in full.
+        """
+        self.last_center = None
+        self.window = None
+
+    def get_window(self, image_shape, config):
+        """
+        Get the search window around the last known center, sized from the upper contour limit.
+        :param image_shape: (int tuple) Shape of the image array.
+        :param config: (DetectionConfig) Settings snapshot.
+        :return: (int tuple) Search window (x, y, w, h) or None if there is no blob to track.
+        """
+        if self.last_center is None:
+            return None
+        half_size = int(self.margin * config.max_radius) + config.gauss
+        x0 = max(int(self.last_center[0]) - half_size, 0)
+        y0 = max(int(self.last_center[1]) - half_size, 0)
+        x1 = min(int(self.last_center[0]) + half_size, image_shape[1])
+        y1 = min(int(self.last_center[1]) + half_size, image_shape[0])
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        return x0, y0, x1 - x0, y1 - y0
+
+    def measure(self, image_array, threshold=None, contour_limits=None, circle_limits=None, fit_circle=False,
+                pyramid=None, context=None, config=None):
+        """
+        Measure blobs around the last known center, falling back to a full-frame search when the blob is lost or
+        touches the window edge.
+        :param image_array: (np.array) Image array to measure.
+        :param threshold: (int) Lower threshold value for cv2.threshold.
+        :param contour_limits: (int list) Lower and upper bounds for area size of found blob.
+        :param circle_limits: (float list) Lower and upper bounds for circularity of found blob.
+        :param fit_circle: (bool) Fit a least squares circle to found blob?
+        :param pyramid: (int) Downsampling factor for the full-frame search (see measure_blobs).
+        :param context: (FrameContext) Shared views of image_array for the full-frame search.
+        :param config: (DetectionConfig) Settings snapshot (see measure_blobs).
+        :return: (dict list) Output of measure_blobs.
+        """
+        if config is None:
+            config = make_detection_config(threshold=threshold, contour_limits=contour_limits,
+                                           circle_limits=circle_limits, fit_circle=fit_circle, pyramid=pyramid)
+
+        # Search the window first, then the full frame
+        blobs = []
+        self.window = self.get_window(image_array.shape, config)
+        if self.window is not None:
+            blobs = measure_blobs(image_array, roi=self.window, config=config)
+            if not all(is_inside_window(blob["bbox"], self.window, image_array.shape, config.pad) for blob in blobs):
+                blobs = []
+        if not blobs:
+            self.window = None
+            blobs = measure_blobs(image_array, context=context, config=config)
+
+        self.last_center = blobs[-1]["center"] if blobs else None
+
+        return blobs
+
+
+def blob_center(blobs):
+    """
+    Get the reported center of a list of measured blobs (the last accepted blob).
+    :param blobs: (dict list) Output of measure_blobs.
+    :return: (int tuple) Center of found blob or (0, 0) if none found.
+    """
+    if blobs:
+        return int(blobs[-1]["center"][0]), int(blobs[-1]["center"][1])
+    return 0, 0
+
+
+def draw_blobs(image_array, blobs, zero_point=None, m_point=None, buffer=None, config=None):
+    """
+    Render measured blobs, zero point and measured point onto an RGB 8-bit copy of the image array.
+    :param image_array: (np.array) Image array the blobs were measured on.
+    :param blobs: (dict list) Output of measure_blobs.
+    :param zero_point: (int tuple) Point of reference.
+    :param m_point: (int tuple) Measured point.
+    :param buffer: (str) Name of a reusable buffer to draw into (see convert_color_bit). Default: a new array.
+    :param config: (DetectionConfig) Settings snapshot (feature size and colors). Default: from the config file.
+    :return: (np.array) RGB 8-bit image with drawn detections.
+    """
+    if config is None:
+        config = make_detection_config()
+    feature_sz, colors = config.feature_size, config.colors
+    drawn_image = convert_color_bit(image_array, "rgb", 8, buffer=buffer)
+    if drawn_image is None:
+        return None
+    if drawn_image is image_array:
+        drawn_image = image_array.copy()
+
+    # Draw blobs
+    for blob in blobs:
+        center = (int(blob["center"][0]), int(blob["center"][1]))
+        if blob["fit"] == "circle":
+            cv2.circle(drawn_image, center, int(blob["radius"]), colors["blob"], feature_sz)
+            cv2.circle(drawn_image, center, feature_sz, colors["blob"], feature_sz)
+        else:
+            cv2.circle(drawn_image, center, feature_sz, colors["blob"], feature_sz)
+            cv2.drawContours(drawn_image, [blob["contour"]], 0, colors["blob"], feature_sz)
+
+    # Draw zero and last measurement
+    if zero_point is not None and zero_point != (0, 0):
+        cv2.circle(drawn_image, zero_point, feature_sz, colors["zero"], feature_sz)
+    if m_point is not None and m_point != (0, 0):
+        cv2.circle(drawn_image, m_point, feature_sz, colors["measured"], feature_sz)
+
+    return drawn_image
+
+
+def preview_region(frame_shape, view_size, zoom=0, center=None, zoom_step=1.25):
+    """
+    Get the region of a frame shown on the stream window and the scale it is shown at.
+    :param frame_shape: (int tuple) Shape of the full-resolution frame.
+    :param view_size: (int tuple) Width and height of the stream window [display pxl].
+    :param zoom: (int) Zoom level: 0 = whole frame fitted to the window, each level magnifies by zoom_step.
+    :param center: (float tuple) Frame coordinates to center the region on. Default: frame center.
+    :param zoom_step: (float) Magnification per zoom level.
+    :return: (int tuple) Region (x0, y0, x1, y1) [frame pxl], (float) display pxl per frame pxl.
+    """
+    height, width = frame_shape[:2]
+    scale = min(view_size[0] / width, view_size[1] / height) * zoom_step ** max(zoom, 0)
+    region_w, region_h = min(width, int(round(view_size[0] / scale))), min(height, int(round(view_size[1] / scale)))
+    center = (width / 2, height / 2) if center is None else center
+    x0 = int(round(min(max(center[0] - region_w / 2, 0), width - region_w)))
+    y0 = int(round(min(max(center[1] - region_h / 2, 0), height - region_h)))
+
+    return (x0, y0, x0 + region_w, y0 + region_h), scale
+
+
+def render_preview(image_array, region, scale):
+    """
+    Render the displayed region of a frame at display resolution: downsampled with area averaging when the whole
+    frame is shown, or cropped to the visible region and enlarged without interpolation when zoomed in.
+    :param image_array: (np.array) Full-resolution RGB 8-bit frame.
+    :param region: (int tuple) Region (x0, y0, x1, y1) from preview_region.
+    :param scale: (float) Display pxl per frame pxl from preview_region.
+    :return: (np.array) Contiguous RGB 8-bit preview image.
+    """
+    x0, y0, x1, y1 = region
+    size = (max(1, int(round((x1 - x0) * scale))), max(1, int(round((y1 - y0) * scale))))
+    preview = image_array[y0:y1, x0:x1]
+    if scale >= 1:
+        return cv2.resize(preview, size, interpolation=cv2.INTER_NEAREST)
+
+    # Area-average in exact halvings (OpenCV's fast path, ~15x faster than one non-integer INTER_AREA resize), then
+    # interpolate the remaining factor below 2
+    while preview.shape[1] >= 2 * size[0] and preview.shape[0] >= 2 * size[1]:
+        even = preview[:preview.shape[0] // 2 * 2, :preview.shape[1] // 2 * 2]
+        preview = cv2.resize(even, (even.shape[1] // 2, even.shape[0] // 2), interpolation=cv2.INTER_AREA)
+
+    return cv2.resize(preview, size, interpolation=cv2.INTER_LINEAR)
+
+
+def synthetic_frame(shape=(1520, 1920), centers=((960, 760),), radius=18, level=230, noise=10, color="rgb",
+                    bit_depth=8, seed=0):
+    """
+    Render a synthetic camera frame: bright filled circles on a dark, noisy background.
+    :param shape: (int tuple) Frame height and width.
+    :param centers: (float tuple list) Blob centers (x, y).
+    :param radius: (int) Blob radius [pxl].
+    :param level: (int) 8-bit brightness of the blobs.
+    :param noise: (int) 8-bit amplitude of the uniform background noise.
+    :param color: (str) Options: 'rgb' or 'mono'
+    :param bit_depth: (int) Options: 8 or 16
+    :param seed: (int) Seed of the background noise (same seed = same frame).
+    :return: (np.array) Synthetic image array.
+    """
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, noise + 1, size=shape, dtype=np.uint8)
+    for center in centers:
+        cv2.circle(frame, (int(round(center[0] * 16)), int(round(center[1] * 16))), int(radius * 16), level, -1,
+                   lineType=cv2.LINE_AA, shift=4)
+
+    return convert_color_bit(frame, color, bit_depth)
+
+
 def detect_blob(image_array, threshold=None, contour_limits=None, circle_limits=None, zero_point=None,
                 m_point=None, fit_circle=False):
     """
@@ -52,57 +682,11 @@ def detect_blob(image_array, threshold=None, contour_limits=None, circle_limits=
     :param fit_circle: (bool) Fit a least squares circle to found blob?
     :return: (np.array) image with drawn detections, (int tuple) center of found blob
     """
-    # Define local variables
-    blob_center = (0, 0)
-    if threshold is None:
-        threshold = json_settings["Detection"]["Threshold"]
-    if contour_limits is None:
-        contour_limits = json_settings["Detection"]["Limits"]
-    poly_fit = json_settings["Detection"]["Poly Fit"]
-    gauss = json_settings["Detection"]["Gaussian"]
-    feature_sz = json_settings["Detection"]["Feature Size"]
-    if circle_limits is None:
-        circle_limits = json_settings["Detection"]["Circularity"]
+    if image_array.size:
+        blobs = measure_blobs(image_array, threshold=threshold, contour_limits=contour_limits,
+                              circle_limits=circle_limits, fit_circle=fit_circle)
+        drawn_image = draw_blobs(image_array, blobs, zero_point=zero_point, m_point=m_point)
 
-    # Baseline image data
-    if image_array.any():
-        drawn_image = convert_color_bit(image_array.copy(), "rgb", 8)
-        image_grey8 = convert_color_bit(image_array.copy(), "mono", 8)
-        image_gauss = cv2.GaussianBlur(image_grey8, (gauss, gauss), 1)
-        ret, thresh = cv2.threshold(image_gauss, threshold, 255, cv2.THRESH_BINARY)
-        contours_found, hierarchy = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-
-        # Detect blobs and their centers using input parameters
-        for contour in contours_found:
-            area = cv2.contourArea(contour)
-            if contour_limits[0] < area < contour_limits[1]:
-                perimeter = cv2.arcLength(contour, True)
-                if perimeter == 0:
-                    break
-                approx = cv2.approxPolyDP(contour, poly_fit, True)
-
-                if fit_circle:  # if the blob is expected to be circular
-                    circularity = 4 * math.pi * (area / (perimeter * perimeter))
-                    if circle_limits[0] < circularity < circle_limits[1]:
-                        individual = np.array([pnt[0] for pnt in approx])
-                        xc, yc, rc, sig = circle_fit.least_squares_circle(individual)
-                        blob_center = (int(xc), int(yc))
-                        cv2.circle(drawn_image, blob_center, int(rc), (255, 0, 0), feature_sz)
-                        cv2.circle(drawn_image, blob_center, feature_sz, (255, 0, 0), feature_sz)
-                else:
-                    moment = cv2.moments(contour)
-                    blob_center_x = moment["m10"] / moment["m00"]
-                    blob_center_y = moment["m01"] / moment["m00"]
-                    blob_center = (int(blob_center_x), int(blob_center_y))
-                    cv2.circle(drawn_image, blob_center, feature_sz, (255, 0, 0), feature_sz)
-                    cv2.drawContours(drawn_image, [approx], 0, (255, 0, 0), feature_sz)
-
-        # Draw zero and last measurement
-        if zero_point is not None and zero_point != (0, 0):
-            cv2.circle(drawn_image, zero_point, feature_sz, (0, 255, 0), feature_sz)
-        if m_point is not None and m_point != (0, 0):
-            cv2.circle(drawn_image, m_point, feature_sz, (0, 0, 255), feature_sz)
-
-        return drawn_image, blob_center
+        return drawn_image, blob_center(blobs)
     else:
         return None, None
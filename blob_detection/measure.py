@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+import sys, time, argparse
+
+# Launch time of the process, for the time to first result (see run_measurement)
+START_TIME = time.perf_counter()
+
+# Define input arguments for command line call. Only the standard library is imported at module level, so --help and
+# argument errors return at once; camera and detection modules are loaded by run_measurement (never Qt or matplotlib).
+argParser = argparse.ArgumentParser(description="Measure blobs on a camera stream without the GUI: camera -> detect -> "
+                                                "log, one CSV row per analysed frame.")
+argParser.add_argument("-n", "--cam_num", type=int, default=0, help="Camera number (index into the \"ID LR\" list)")
+argParser.add_argument("-b", "--backend", help="Camera backend (IMAQdx, OpenCV, Synthetic, Replay). Default: config")
+argParser.add_argument("-r", "--replay", help="Replay a recorded session folder instead of streaming from the camera")
+argParser.add_argument("-f", "--frames", type=int, default=0, help="Stop after this many frames. Default: no limit")
+argParser.add_argument("-d", "--duration", type=float, default=0, help="Stop after this many seconds. Default: no limit")
+argParser.add_argument("-o", "--output", help="Path to output CSV. Default: print rows to stdout")
+argParser.add_argument("-c", "--config", help="Path to a settings JSON. Default: the package gui_settings.json")
+argParser.add_argument("-e", "--exposure", type=float, default=None, help="Exposure [us]. Default: config")
+argParser.add_argument("-g", "--gamma", type=float, default=None, help="Gamma. Default: config")
+argParser.add_argument("-t", "--threshold", type=int, default=None, help="Detection threshold")
+argParser.add_argument("--contours", type=int, nargs=2, default=None, help="Lower and upper blob area limits")
+argParser.add_argument("--circularity", type=float, nargs=2, default=None, help="Lower and upper circularity limits")
+argParser.add_argument("--circle_fit", action="store_true", help="Fit a circle to found blobs")
+argParser.add_argument("--pyramid", type=int, default=None, help="Find candidates on a 2x or 4x downsampled image")
+
+LOG_HEADER = ["Frame", "Sequence", "Timestamp (s)", "X (pxl)", "Y (pxl)", "Area (pxl)", "Circularity",
+              "Saturation (%)", "Level", "Detect (ms)"]
+
+
+def message(*args):
+    """
+    Print a status message to stderr, so results printed to stdout stay a clean CSV.
+    :param args: Values to print.
+    """
+    print(*args, file=sys.stderr)
+
+
+def run_measurement(argv=None):
+    """
+    Command line entry point (blob-detect): stream frames from a camera through an acquire -> analyse -> log pipeline
+    until the frame count or duration is reached, the replay ends or Ctrl+C is pressed.
+    :param argv: (str list) Command line arguments. Default: sys.argv.
+    :return: (int) Exit code (0 = success, 1 = camera failure, 2 = a pipeline stage failed).
+    """
+    args = argParser.parse_args(argv)
+
+    # Camera, driver and pipeline messages are printed to stdout: send them to stderr while the results are written
+    # to the real stdout, so it stays a clean CSV
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        return measure_stream(args, stdout)
+    finally:
+        sys.stdout = stdout
+
+
+def measure_stream(args, stdout):
+    """
+    Run the measurement of run_measurement.
+    :param args: (argparse.Namespace) Parsed command line arguments.
+    :param stdout: (file) Standard output the results are printed to when no output file is given.
+    :return: (int) Exit code (see run_measurement).
+    """
+    import csv, json, threading
+    import blob_detection.hardware as hw
+    import blob_detection.img_processing as ip
+    import blob_detection.pipeline as pipe
+
+    settings = ip.json_settings
+    if args.config is not None:
+        with open(args.config) as f:
+            settings = json.load(f)
+
+    # Connect to camera (same backend selection as the GUI)
+    camera_settings = settings["Camera"]
+    if args.backend is not None:
+        camera_settings = dict(camera_settings, Backend=args.backend)
+    if args.replay is not None:
+        replay_settings = dict(camera_settings.get("Replay", {}), Session=args.replay)
+        camera_settings = dict(camera_settings, Backend="Replay", Replay=replay_settings)
+    camera = hw.load_camera(camera_settings, hw.get_device_id(camera_settings, args.cam_num))
+    if camera is None or camera.device is None:
+        message("CAMERA FAILURE")
+        return 1
+    camera.control.submit("exposure", args.exposure if args.exposure is not None else camera_settings["Exposure us"])
+    camera.control.submit("gamma", args.gamma if args.gamma is not None else camera_settings["Gamma"])
+
+    config = ip.make_detection_config(settings["Detection"], threshold=args.threshold, contour_limits=args.contours,
+                                      circle_limits=args.circularity, fit_circle=args.circle_fit or None,
+                                      pyramid=args.pyramid)
+    tracker = ip.BlobTracker()
+    measure = tracker.measure if config.tracking else ip.measure_blobs
+    output = open(args.output, "w", newline="") if args.output else stdout
+    writer_object = csv.writer(output)
+    writer_object.writerow(LOG_HEADER)
+    state = {"sequence": 0, "acquired": 0, "logged": 0, "first_result": None, "is_drained": False}
+    is_done = threading.Event()
+
+    def acquire():
+        """
+        Acquire stage: wait for the next frame in the camera's frame ring.
+        :return: (ip.FrameContext, float) The new frame and its timestamp or None if none arrived.
+        """
+        sequence, timestamp, frame = camera.ring.wait_for_frame(state["sequence"], timeout=0.25)
+        if frame is None:
+            if camera.ring.is_closed:
+                # Stream ended (e.g. a replay without loop) and its last frame was taken
+                state["is_drained"] = True
+                time.sleep(0.1)
+            return None
+        state["sequence"] = sequence
+        state["acquired"] += 1
+
+        return ip.FrameContext(frame, sequence), timestamp
+
+    def analyse(item):
+        """
+        Analyse stage: measure saturation and detect blobs, the same way the live stream does.
+        :param item: (ip.FrameContext, float) Output of the acquire stage.
+        :return: (list) Row of results in the order of LOG_HEADER.
+        """
+        context, timestamp = item
+        start = time.perf_counter()
+        saturation = ip.measure_saturation(context.histogram(stride=config.saturation_stride))
+        blobs = measure(context.image_array, context=context, config=config)
+        detect_ms = (time.perf_counter() - start) * 1000
+        center = ip.blob_center(blobs)
+        area, circularity = (blobs[-1]["area"], blobs[-1]["circularity"]) if blobs else (0, 0)
+
+        return [context.sequence, "%.4f" % (timestamp - START_TIME), center[0], center[1], area,
+                "%.4f" % circularity, "%.2f" % saturation["saturation"], saturation["level"], "%.2f" % detect_ms]
+
+    def log(row):
+        """
+        Log stage: write one row of results and stop once the frame count is reached.
+        :param row: (list) Output of the analyse stage.
+        """
+        if is_done.is_set():
+            return None
+        if state["first_result"] is None:
+            state["first_result"] = time.perf_counter() - START_TIME
+        writer_object.writerow([state["logged"]] + row)
+        state["logged"] += 1
+        if args.frames and state["logged"] >= args.frames:
+            is_done.set()
+
+        return None
+
+    # Every frame of a replay that is not realtime is measured (lockstep); a live camera drops frames it cannot keep
+    # up with in the pipeline queues instead of falling behind
+    pipeline = pipe.Pipeline(stats=camera.stats)
+    pipeline.add_stage("acquire", acquire)
+    pipeline.add_stage("analyse", analyse)
+    pipeline.add_stage("log", log, maxsize=64)
+    pipeline.is_lockstep = isinstance(camera, hw.ReplayCam) and not camera.is_realtime
+    pipeline.start()
+    try:
+        while not is_done.wait(0.05):
+            if args.duration and time.perf_counter() - START_TIME >= args.duration:
+                break
+            # A replay without loop ends after its last frame: stop once every acquired frame is handled
+            if state["is_drained"] and state["logged"] + sum(pipeline.dropped().values()) >= state["acquired"]:
+                break
+            # A frame that failed in a stage is missing from the results: stop instead of logging an incomplete run
+            if pipeline.errors:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        is_done.set()
+        pipeline.stop()
+        camera.close()
+        if output is not stdout:
+            output.close()
+
+    elapsed = time.perf_counter() - START_TIME
+    message("Measured %i frames in %.2f s (%i dropped). First result after %.3f s." %
+            (state["logged"], elapsed, camera.ring.dropped + sum(pipeline.dropped().values()),
+             state["first_result"] if state["first_result"] is not None else float("nan")))
+    if args.output:
+        message("Saved results to:", args.output)
+    if pipeline.errors:
+        message("FAILED: errors in stage(s) %s" % ", ".join("%s (%i)" % error for error in pipeline.errors.items()))
+        return 2
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_measurement())
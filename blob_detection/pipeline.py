@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import deque
+
+
+class LatestQueue:
+
+    def __init__(self, maxsize=1):
+        """
+        Bounded queue between two pipeline stages. When it is full, the oldest item is dropped to make room for the
+        newest (latest wins), so a slow stage always works on the most recent data and never builds up a backlog.
+        :param maxsize: (int) Maximum number of waiting items.
+        """
+        self.items = deque()
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.is_closed = False
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item, block=False, timeout=None):
+        """
+        Add an item, dropping the oldest waiting item if the queue is full.
+        :param item: Item to add.
+        :param block: (bool) Wait for room instead of dropping (lets a source run in lockstep with its consumer).
+        :param timeout: (float) Maximum time to wait for room when blocking [s]. Default: until room or close.
+        """
+        with self.condition:
+            if block:
+                self.condition.wait_for(lambda: len(self.items) < self.maxsize or self.is_closed, timeout)
+            if self.is_closed:
+                return
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Block until an item is waiting and take the oldest one.
+        :param timeout: (float) Maximum time to wait [s]. Default: wait until an item arrives or the queue closes.
+        :return: Item or None on timeout or close.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.items or self.is_closed, timeout)
+            if not self.items or self.is_closed:
+                return None
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        """
+        Close the queue and wake all waiting stages.
+        """
+        with self.condition:
+            self.is_closed = True
+            self.items.clear()
+            self.condition.notify_all()
+
+
+class Pipeline:
+
+    def __init__(self, stats=None):
+        """
+        Chain of processing stages, each on its own thread and connected by LatestQueues. The first stage is the
+        source: its function is called repeatedly and must block (with a timeout) until it has a new item. Every other
+        stage sleeps until an item arrives, so an idle pipeline uses no CPU.
+        :param stats: (diag.StageStats) Statistics the queue backlog, drops and errors are reported to
+                      ("backlog_<stage>", "dropped_<stage>", "errors_<stage>"). Default: not reported.
+        """
+        self.stats = stats
+        self.errors = {}  # stage name: number of items that raised an error in the stage
+        self.stages = []  # (name, function, inbox)
+        self.outboxes = {}  # stage name: inboxes of the stages fed by it
+        self.threads = []
+        self.is_running = False
+        self.is_lockstep = False  # stages wait for room downstream instead of dropping (e.g. replay every frame)
+
+    def add_stage(self, name, function, after=None, maxsize=1):
+        """
+        Add a stage.
+        :param name: (str) Name of the stage.
+        :param function: (function) Source: function() -> item or None. Others: function(item) -> item for the next
+                         stages or None (nothing to pass on).
+        :param after: (str) Stage that feeds this one. Default: the previously added stage.
+        :param maxsize: (int) Size of the stage's input queue.
+        """
+        inbox = None
+        if self.stages:
+            inbox = LatestQueue(maxsize)
+            self.outboxes[after if after is not None else self.stages[-1][0]].append(inbox)
+        self.stages.append((name, function, inbox))
+        self.outboxes[name] = []
+
+    def start(self):
+        """
+        Start a thread for every stage.
+        """
+        self.is_running = True
+        self.threads = [threading.Thread(target=self.threaded_stage, args=stage, daemon=True) for stage in self.stages]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, timeout=2):
+        """
+        Stop all stages: close their queues so waiting stages wake up, then wait for the threads to finish.
+        :param timeout: (float) Maximum time to wait for each stage to finish its current item [s].
+        """
+        self.is_running = False
+        for name, function, inbox in self.stages:
+            if inbox is not None:
+                inbox.close()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def backlog(self):
+        """
+        Get the number of items waiting in front of every stage.
+        :return: (dict) Waiting items by stage name.
+        """
+        return {name: len(inbox) for name, function, inbox in self.stages if inbox is not None}
+
+    def dropped(self):
+        """
+        Get the number of items every stage dropped because it fell behind (see LatestQueue.put).
+        :return: (dict) Dropped items by stage name.
+        """
+        return {name: inbox.dropped for name, function, inbox in self.stages if inbox is not None}
+
+    def threaded_stage(self, name, function, inbox):
+        """
+        Background thread of one stage: take the next item, process it and pass the result on. An item whose stage
+        function raises is dropped; the first error of each stage is printed and all of them are counted.
+        :param name: (str) Name of the stage.
+        :param function: (function) Stage function (see add_stage).
+        :param inbox: (LatestQueue) Input queue or None for the source.
+        """
+        while self.is_running:
+            try:
+                if inbox is None:
+                    result = function()
+                else:
+                    item = inbox.get()
+                    if item is None:
+                        continue
+                    result = function(item)
+                    if self.stats is not None:
+                        self.stats.set_counter("backlog_%s" % name, len(inbox))
+                        self.stats.set_counter("dropped_%s" % name, inbox.dropped)
+                if result is not None:
+                    for outbox in self.outboxes[name]:
+                        outbox.put(result, block=self.is_lockstep)
+            except Exception as er:
+                self.errors[name] = self.errors.get(name, 0) + 1
+                if self.errors[name] == 1:
+                    print("ERROR Pipeline stage '%s': %s: %s (further errors are only counted)" %
+                          (name, type(er).__name__, er))
+                if self.stats is not None:
+                    self.stats.set_counter("errors_%s" % name, self.errors[name])
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+import os, json, time, queue, threading
+import cv2
+import numpy as np
+from datetime import datetime
+
+# Index record of every recorded frame (frame i is slot i % chunk frames of chunk i // chunk frames)
+INDEX_DTYPE = np.dtype([("sequence", "<i8"), ("timestamp", "<f8"), ("exposure_us", "<f4"), ("gamma", "<f4")])
+SESSION_FILE = "session.json"
+INDEX_FILE = "index.bin"
+CHUNK_FILE = "chunk_%05i.raw"
+# File extension of each image format of the ImageWriter
+IMAGE_FORMATS = {"png": ".png", "tiff": ".tif", "npy": ".npy"}
+
+
+def chunk_frames_for(frame_shape, dtype, chunk_mb=1024):
+    """
+    Get the number of frames per chunk file for a chunk size.
+    :param frame_shape: (int tuple) Shape of one frame.
+    :param dtype: (np.dtype) Data type of the frames.
+    :param chunk_mb: (float) Size of one chunk file [MB].
+    :return: (int) Frames per chunk.
+    """
+    frame_bytes = int(np.prod(frame_shape)) * np.dtype(dtype).itemsize
+
+    return max(1, int(chunk_mb * 2 ** 20 // frame_bytes))
+
+
+class FrameRecorder:
+
+    def __init__(self, camera, folder, chunk_mb=1024):
+        """
+        Record every frame the camera publishes into raw, memory-mapped chunk files with a compact index. Frames are
+        copied out of the camera's frame ring by a dedicated writer thread, so acquisition is never blocked; frames
+        that were overwritten in the ring before the writer got to them, or that do not match the frame shape of the
+        session (e.g. after an ROI change), are counted in self.dropped.
+        :param camera: (hw.Camera) Streaming camera.
+        :param folder: (str) Folder the session folder "rec_<date>" is created in.
+        :param chunk_mb: (float) Size of one preallocated chunk file [MB].
+        """
+        self.camera = camera
+        self.chunk_mb = chunk_mb
+        self.session_path = os.path.join(folder, "rec_%s" % datetime.now().strftime("%Y%m%d-%H%M%S"))
+        self.session = {}
+        self.frame_count = 0
+        self.dropped = 0
+        self.is_recording = False
+        self.chunk = None
+        self.chunk_num = -1
+        self.index_file = None
+        self.record_thread = threading.Thread(target=self.threaded_record, daemon=True)
+
+    def start(self):
+        """
+        Start recording from the next published frame.
+        """
+        os.makedirs(self.session_path, exist_ok=True)
+        self.index_file = open(os.path.join(self.session_path, INDEX_FILE), "wb")
+        self.is_recording = True
+        self.record_thread.start()
+        print("Recording to:", self.session_path)
+
+    def stop(self):
+        """
+        Stop recording, flush all files and write the session description.
+        :return: (str) Path to the session folder.
+        """
+        self.is_recording = False
+        if self.record_thread.is_alive():
+            self.record_thread.join()
+        print("Recorded %i frames (%i dropped) to: %s" % (self.frame_count, self.dropped, self.session_path))
+
+        return self.session_path
+
+    def threaded_record(self):
+        """
+        Background thread: copy each new frame from the camera's ring into the current chunk and append its index.
+        """
+        ring = self.camera.ring
+        last_sequence = ring.sequence
+        while self.is_recording:
+            sequence, timestamp, frame = ring.wait_for_next(last_sequence, timeout=0.1)
+            if frame is None:
+                continue
+            if not self.session:
+                self.start_session(frame, timestamp)
+            if list(frame.shape) != self.session["Frame Shape"]:
+                self.dropped += sequence - last_sequence
+                last_sequence = sequence
+                continue
+
+            # Copy into the chunk, then make sure the slot was not overwritten while copying
+            if self.frame_count // self.session["Chunk Frames"] != self.chunk_num:
+                self.open_chunk(self.frame_count // self.session["Chunk Frames"])
+            self.chunk[self.frame_count % self.session["Chunk Frames"]] = frame
+            if not ring.is_valid(sequence):
+                self.dropped += sequence - last_sequence
+                last_sequence = sequence
+                continue
+            self.dropped += sequence - last_sequence - 1
+            last_sequence = sequence
+
+            record = np.array((sequence, timestamp, self.camera.exposure_us, self.camera.gamma), INDEX_DTYPE)
+            self.index_file.write(record.tobytes())
+            self.frame_count += 1
+        self.close_session()
+
+    def start_session(self, frame, timestamp):
+        """
+        Fix the frame format of the session from its first frame.
+        :param frame: (np.array) First recorded frame.
+        :param timestamp: (float) Acquisition time of the frame [s, time.perf_counter()].
+        """
+        self.session = {"Frame Shape": list(frame.shape), "Dtype": frame.dtype.str,
+                        "Chunk Frames": chunk_frames_for(frame.shape, frame.dtype, self.chunk_mb),
+                        "Start Time": datetime.now().timestamp() - (time.perf_counter() - timestamp),
+                        "Start Counter": timestamp}
+
+    def open_chunk(self, chunk_num):
+        """
+        Flush the current chunk and preallocate the next one.
+        :param chunk_num: (int) Number of the chunk to open.
+        """
+        if self.chunk is not None:
+            self.chunk.flush()
+            self.index_file.flush()
+        self.chunk_num = chunk_num
+        shape = (self.session["Chunk Frames"],) + tuple(self.session["Frame Shape"])
+        self.chunk = np.memmap(os.path.join(self.session_path, CHUNK_FILE % chunk_num), dtype=self.session["Dtype"],
+                               mode="w+", shape=shape)
+
+    def close_session(self):
+        """
+        Flush and close all files, trim the unused part of the last chunk and write the session description.
+        """
+        if self.chunk is not None:
+            self.chunk.flush()
+            chunk_path = self.chunk.filename
+            self.chunk = None  # unmaps the file
+            used_frames = self.frame_count - self.chunk_num * self.session["Chunk Frames"]
+            os.truncate(chunk_path, used_frames * int(np.prod(self.session["Frame Shape"])) *
+                        np.dtype(self.session["Dtype"]).itemsize)
+        self.index_file.close()
+
+        self.session["Frames"] = self.frame_count
+        self.session["Dropped"] = self.dropped
+        with open(os.path.join(self.session_path, SESSION_FILE), "w") as f:
+            json.dump(self.session, f, indent=4)
+
+
+class Recording:
+
+    def __init__(self, session_path):
+        """
+        Read access to a recorded session. Chunk files are memory-mapped read-only, so frames are served straight
+        from the page cache without copying.
+        :param session_path: (str) Path to the session folder (contains session.json).
+        """
+        with open(os.path.join(session_path, SESSION_FILE)) as f:
+            self.session = json.load(f)
+        self.session_path = session_path
+        self.frame_count = self.session["Frames"]
+        self.chunk_frames = self.session["Chunk Frames"]
+        self.index = np.fromfile(os.path.join(session_path, INDEX_FILE), INDEX_DTYPE)[:self.frame_count]
+
+        # Map every chunk (the last one only holds the remaining frames)
+        shape = tuple(self.session["Frame Shape"])
+        self.chunks = []
+        for chunk_num in range(-(-self.frame_count // self.chunk_frames)):
+            n_frames = min(self.chunk_frames, self.frame_count - chunk_num * self.chunk_frames)
+            self.chunks.append(np.memmap(os.path.join(session_path, CHUNK_FILE % chunk_num),
+                                         dtype=self.session["Dtype"], mode="r", shape=(n_frames,) + shape))
+
+    def __len__(self):
+        return self.frame_count
+
+    def frame(self, frame_num):
+        """
+        Get a recorded frame without copying.
+        :param frame_num: (int) Frame number (0 = first recorded frame).
+        :return: (np.array) Read-only image frame.
+        """
+        return self.chunks[frame_num // self.chunk_frames][frame_num % self.chunk_frames]
+
+
+class ImageWriter:
+
+    def __init__(self, max_pending=8, image_format="png", png_compression=1):
+        """
+        Save single image frames (captures and measurement images) on a dedicated writer thread. The backlog is
+        bounded: a save that finds max_pending frames still waiting is rejected and counted in self.rejected instead
+        of blocking the caller or growing memory. Unique file names are allocated up front from an in-memory counter
+        per directory, so a burst of captures never probes the disk for free names. A write that fails (e.g. the
+        folder is gone or the disk is full) is reported and counted in self.failed; the writer keeps going.
+        :param max_pending: (int) Maximum number of frames waiting to be written.
+        :param image_format: (str) 'png', 'tiff' (uncompressed) or 'npy' (raw array, fastest).
+        :param png_compression: (int) PNG compression level 0-9 (0 = fastest, largest files).
+        """
+        if image_format not in IMAGE_FORMATS:
+            image_format = "png"
+        self.image_format = image_format
+        self.png_compression = png_compression
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.taken = {}  # directory: set of file names present or allocated
+        self.counters = {}  # (directory, name, extension): last suffix number used
+        self.written = 0
+        self.rejected = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.is_running = True
+        self.write_thread = threading.Thread(target=self.threaded_write, daemon=True)
+        self.write_thread.start()
+
+    def unique_path(self, save_path):
+        """
+        Allocate a unique path for a new file: a duplicate name gets a " (n)" suffix like hw.check_path, but the
+        directory is only listed the first time it is used.
+        :param save_path: (str) Requested path (the extension is replaced by the one of the image format).
+        :return: (str) Path that no other file or pending save uses.
+        """
+        directory, file_name = os.path.split(save_path)
+        name = os.path.splitext(file_name)[0]
+        extension = IMAGE_FORMATS[self.image_format]
+        with self.lock:
+            if directory not in self.taken:
+                self.taken[directory] = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+            taken = self.taken[directory]
+            file_name = name + extension
+            if file_name in taken:
+                key = (directory, name, extension)
+                count = self.counters.get(key, 0)
+                while file_name in taken:
+                    count += 1
+                    file_name = "%s (%i)%s" % (name, count, extension)
+                self.counters[key] = count
+            taken.add(file_name)
+
+        return os.path.join(directory, file_name)
+
+    def save(self, save_path, frame):
+        """
+        Queue a frame to be written. The frame is copied, so the caller may reuse its buffer right away.
+        :param save_path: (str) Requested path (see unique_path).
+        :param frame: (np.array) Image frame (RGB or mono, 8 or 16 bit).
+        :return: (str) Path the frame will be written to or None if the backlog is full.
+        """
+        if self.pending.full():
+            self.rejected += 1
+            print("ERROR: Save queue full (%i pending), frame not saved:" % self.pending.qsize(), save_path)
+            return None
+        save_path = self.unique_path(save_path)
+        try:
+            self.pending.put_nowait((save_path, frame.copy()))
+        except queue.Full:
+            self.rejected += 1
+            return None
+
+        return save_path
+
+    def backlog(self):
+        """
+        Get the number of frames waiting to be written.
+        :return: (int) Pending frames.
+        """
+        return self.pending.qsize()
+
+    def write(self, save_path, frame):
+        """
+        Write a frame in the image format of the writer (images on disk are BGR, arrays keep the stream's RGB order).
+        :param save_path: (str) Path to file.
+        :param frame: (np.array) Image frame.
+        :return: (bool) True if the file was written.
+        """
+        if self.image_format == "npy":
+            np.save(save_path, frame)
+            return True
+        if len(frame.shape) == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        if self.image_format == "tiff":
+            return cv2.imwrite(save_path, frame, [cv2.IMWRITE_TIFF_COMPRESSION, 1])  # 1 = no compression
+        return cv2.imwrite(save_path, frame, [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression])
+
+    def threaded_write(self):
+        """
+        Background thread: write queued frames in order until closed and the backlog is empty. A failed write only
+        loses its own frame.
+        """
+        while self.is_running or not self.pending.empty():
+            try:
+                save_path, frame = self.pending.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                is_written = self.write(save_path, frame)
+            except Exception as er:
+                print("ERROR: Could not save frame:", save_path, er)
+                is_written = False
+            else:
+                if not is_written:
+                    print("ERROR: Could not save frame:", save_path)
+            if is_written:
+                self.written += 1
+            else:
+                self.failed += 1
+
+    def close(self):
+        """
+        Write the remaining backlog and stop the writer thread.
+        """
+        self.is_running = False
+        if self.write_thread.is_alive():
+            self.write_thread.join()
+
+
+def is_session(path):
+    """
+    Check whether a path is a recorded session folder.
+    :param path: (str) Path to check.
+    :return: (bool) True if the folder holds a session description.
+    """
+    return os.path.isfile(os.path.join(path, SESSION_FILE))
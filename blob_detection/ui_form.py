@@ -216,6 +216,14 @@ class Ui_Widget(object):
         sizePolicy1.setHeightForWidth(self.camera_connect_button.sizePolicy().hasHeightForWidth())
         self.camera_connect_button.setSizePolicy(sizePolicy1)
         self.camera_connect_button.setAutoDefault(False)
+        self.camera_record_button = QPushButton(self.camera_tab)
+        self.camera_record_button.setObjectName(u"camera_record_button")
+        self.camera_record_button.setGeometry(QRect(340, 20, 75, 25))
+        self.camera_record_button.setAutoDefault(False)
+        self.camera_auto_exposure_button = QPushButton(self.camera_tab)
+        self.camera_auto_exposure_button.setObjectName(u"camera_auto_exposure_button")
+        self.camera_auto_exposure_button.setGeometry(QRect(420, 60, 35, 23))
+        self.camera_auto_exposure_button.setAutoDefault(False)
         self.camera_id_label = QLabel(self.camera_tab)
         self.camera_id_label.setObjectName(u"camera_id_label")
         self.camera_id_label.setGeometry(QRect(10, 20, 100, 24))
@@ -226,6 +234,16 @@ class Ui_Widget(object):
         self.camera_com_spin.setGeometry(QRect(121, 20, 75, 25))
         self.camera_com_spin.setMaximum(10)
         self.camera_com_spin.setValue(1)
+        self.camera_replay_label = QLabel(self.camera_tab)
+        self.camera_replay_label.setObjectName(u"camera_replay_label")
+        self.camera_replay_label.setGeometry(QRect(10, 160, 100, 20))
+        self.camera_replay_label.setAlignment(Qt.AlignRight|Qt.AlignTrailing|Qt.AlignVCenter)
+        self.camera_replay_slider = QSlider(self.camera_tab)
+        self.camera_replay_slider.setObjectName(u"camera_replay_slider")
+        self.camera_replay_slider.setEnabled(False)
+        self.camera_replay_slider.setGeometry(QRect(120, 160, 211, 20))
+        self.camera_replay_slider.setMaximum(0)
+        self.camera_replay_slider.setOrientation(Qt.Horizontal)
         self.camera_file_name_label = QLabel(self.camera_tab)
         self.camera_file_name_label.setObjectName(u"camera_file_name_label")
         self.camera_file_name_label.setGeometry(QRect(10, 130, 100, 24))
@@ -297,11 +315,29 @@ class Ui_Widget(object):
         self.settings_crosshairs_check = QCheckBox(self.tab)
         self.settings_crosshairs_check.setObjectName(u"settings_crosshairs_check")
         self.settings_crosshairs_check.setGeometry(QRect(120, 110, 75, 22))
+        self.settings_tracking_check = QCheckBox(self.tab)
+        self.settings_tracking_check.setObjectName(u"settings_tracking_check")
+        self.settings_tracking_check.setGeometry(QRect(300, 50, 75, 22))
         self.settings_circularity_label_2 = QLabel(self.tab)
         self.settings_circularity_label_2.setObjectName(u"settings_circularity_label_2")
         self.settings_circularity_label_2.setGeometry(QRect(10, 110, 100, 24))
         self.settings_circularity_label_2.setAlignment(Qt.AlignRight|Qt.AlignTrailing|Qt.AlignVCenter)
         self.control_tab_box.addTab(self.tab, "")
+        self.diagnostics_tab = QWidget()
+        self.diagnostics_tab.setObjectName(u"diagnostics_tab")
+        self.diagnostics_table_label = QLabel(self.diagnostics_tab)
+        self.diagnostics_table_label.setObjectName(u"diagnostics_table_label")
+        self.diagnostics_table_label.setGeometry(QRect(10, 5, 435, 140))
+        self.diagnostics_table_label.setAlignment(Qt.AlignLeading|Qt.AlignLeft|Qt.AlignTop)
+        font2 = QFont("Consolas")
+        font2.setStyleHint(QFont.Monospace)
+        font2.setPointSize(8)
+        self.diagnostics_table_label.setFont(font2)
+        self.diagnostics_save_button = QPushButton(self.diagnostics_tab)
+        self.diagnostics_save_button.setObjectName(u"diagnostics_save_button")
+        self.diagnostics_save_button.setGeometry(QRect(350, 150, 90, 25))
+        self.diagnostics_save_button.setAutoDefault(False)
+        self.control_tab_box.addTab(self.diagnostics_tab, "")
         self.browse_button = QToolButton(Widget)
         self.browse_button.setObjectName(u"browse_button")
         self.browse_button.setGeometry(QRect(450, 420, 24, 24))
@@ -373,7 +409,10 @@ class Ui_Widget(object):
         self.camera_capture_button.setText(QCoreApplication.translate("Widget", u"Capture", None))
         self.camera_connect_indicator.setText("")
         self.camera_connect_button.setText(QCoreApplication.translate("Widget", u"Connect", None))
+        self.camera_record_button.setText(QCoreApplication.translate("Widget", u"Record", None))
+        self.camera_auto_exposure_button.setText(QCoreApplication.translate("Widget", u"Auto", None))
         self.camera_id_label.setText(QCoreApplication.translate("Widget", u"Device ID:", None))
+        self.camera_replay_label.setText(QCoreApplication.translate("Widget", u"Replay:", None))
         self.camera_file_name_label.setText(QCoreApplication.translate("Widget", u"File Name:", None))
         self.control_tab_box.setTabText(self.control_tab_box.indexOf(self.camera_tab), QCoreApplication.translate("Widget", u"Camera", None))
         self.settings_contour_limits_label.setText(QCoreApplication.translate("Widget", u"Blob Size:", None))
@@ -382,8 +421,12 @@ class Ui_Widget(object):
         self.settings_save_config_button.setText(QCoreApplication.translate("Widget", u"Save to Config", None))
         self.settings_circle_fit_check.setText(QCoreApplication.translate("Widget", u"Circle fit", None))
         self.settings_crosshairs_check.setText(QCoreApplication.translate("Widget", u"Crosshairs", None))
+        self.settings_tracking_check.setText(QCoreApplication.translate("Widget", u"Tracking", None))
         self.settings_circularity_label_2.setText(QCoreApplication.translate("Widget", u"Overlays:", None))
         self.control_tab_box.setTabText(self.control_tab_box.indexOf(self.tab), QCoreApplication.translate("Widget", u"Detection", None))
+        self.diagnostics_table_label.setText(QCoreApplication.translate("Widget", u"Waiting for frames...", None))
+        self.diagnostics_save_button.setText(QCoreApplication.translate("Widget", u"Save CSV", None))
+        self.control_tab_box.setTabText(self.control_tab_box.indexOf(self.diagnostics_tab), QCoreApplication.translate("Widget", u"Diagnostics", None))
         self.browse_button.setText(QCoreApplication.translate("Widget", u"...", None))
         self.save_path_label.setText(QCoreApplication.translate("Widget", u"Save Path:", None))
         self.saturation_label.setText(QCoreApplication.translate("Widget", u"saturation:", None))
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
-import sys, PySide6, matplotlib, json, time, cv2, os, argparse, ctypes, csv
+import sys, PySide6, json, time, cv2, os, argparse, ctypes, csv
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import blob_detection.hardware as hw
 import blob_detection.img_processing as ip
+import blob_detection.diagnostics as diag
+import blob_detection.recording as rec
+import blob_detection.pipeline as pipe
 from datetime import datetime
 from PySide6 import QtCore
 from PySide6.QtGui import (QImage, QPixmap, QCloseEvent, QPalette, QColor)
@@ -11,15 +15,17 @@ from PySide6.QtWidgets import (QApplication, QWidget, QFileDialog, QGraphicsScen
 from blob_detection.ui_form import Ui_Widget
 
 
-# Adjust debugger and define input arguments for command line call
-matplotlib.use('tkagg')
+# Define input arguments for command line call
 argParser = argparse.ArgumentParser()
-argParser.add_argument("-n", "--cam_num", type=int, help="Camera number")
+argParser.add_argument("-n", "--cam_num", type=int, nargs="+", help="Camera number(s); one window per camera")
+argParser.add_argument("-r", "--replay", help="Replay a recorded session folder instead of streaming from the camera")
 
 
 class Widget(QWidget):
+    frame_ready = QtCore.Signal()  # a new display frame is waiting (emitted by ThreadStream)
+    auto_exposure_finished = QtCore.Signal()  # auto exposure settled (emitted by the auto exposure thread)
 
-    def __init__(self, camera_num, parent=None):
+    def __init__(self, camera_num, replay_path=None, detection_pool=None, image_writer=None, parent=None):
         super().__init__(parent)
         self.ui = Ui_Widget()
         self.ui.setupUi(self)
@@ -27,20 +33,27 @@ class Widget(QWidget):
         self.main_thread = QtCore.QThread.currentThread()
 
         # Local Variables ------------------------------------------------------------------------------------------- #
-        try:
-            self.settings_path = os.path.join(os.getcwd(), "blob_detection\\support\\gui_settings.json")
-            with open(self.settings_path) as f:
-                self.json_settings = json.load(f)
-        except FileNotFoundError:
-            self.settings_path = os.path.join(os.getcwd(), "..\\blob_detection\\support\\gui_settings.json")
-            with open(self.settings_path) as f:
-                self.json_settings = json.load(f)
+        self.settings_path = ip.SETTINGS_PATH
+        with open(self.settings_path) as f:
+            self.json_settings = json.load(f)
 
         self.camera_num = camera_num
+        self.replay_path = replay_path  # recorded session replayed instead of the configured camera
+        self.detection_pool = detection_pool if detection_pool is not None else ThreadPoolExecutor(max_workers=1)
+        self.is_own_writer = image_writer is None
+        if self.is_own_writer:
+            save_settings = self.json_settings.get("Saving", {})
+            image_writer = rec.ImageWriter(max_pending=save_settings.get("Queue Size", 8),
+                                           image_format=save_settings.get("Format", "png"),
+                                           png_compression=save_settings.get("PNG Compression", 1))
+        self.image_writer = image_writer
         self.camera = None
+        self.recorder = None
+        self.stream = None
         self.pixmap = None
         self.is_dialog_open = False
         self.is_closed = False
+        self.is_displayed = False  # window shown and not minimized (set on the GUI thread, read by ThreadStream)
         self.is_test = False  # set this to True if you do not want to load hardware
         self.is_circle_fit = False
         self.is_zeroed = False
@@ -49,30 +62,64 @@ class Widget(QWidget):
         self.json_width = 48
         self.output_on_close = 0
         self.zoom = 0
+        self.zoom_center = None  # frame coordinates the zoomed preview is centered on
         self.armin_per_pxl = 0
         self.pxl_size_mm = 0
         self.raw_frame = np.array([])
         self.drawn_frame = np.array([])
+        self.display_frame = None  # latest preview (and its region, see ip.preview_region) handed to the GUI thread
+        self.display_region = None  # region of the frame shown on the stream window
+        self.is_render_pending = False
+        self.is_first_frame = True
+        self.last_detected = (0, 0)
+        self.last_diagnostics = 0
         self.blob_kpis = {}
+        self.tracker = ip.BlobTracker()
+        self.stats = diag.StageStats()
         self.set_defaults()
+        self.detection_config = None  # settings snapshot read by the stream (replaced, never modified)
+        self.publish_detection_config()
+
+        # Stream display: one long-lived scene and pixmap item, updated on the GUI thread ------------------------- #
+        self.scene = QGraphicsScene()
+        self.pixmap_item = QGraphicsPixmapItem()
+        self.scene.addItem(self.pixmap_item)
+        self.ui.stream_window.setScene(self.scene)
+        self.view_size = (self.ui.stream_window.viewport().width(), self.ui.stream_window.viewport().height())
+        self.frame_ready.connect(self.render_frame, QtCore.Qt.QueuedConnection)
+        self.auto_exposure_finished.connect(self.auto_exposure_done, QtCore.Qt.QueuedConnection)
 
         # Buttons --------------------------------------------------------------------------------------------------- #
         self.ui.camera_capture_button.clicked.connect(self.click_capture)
+        self.ui.camera_record_button.clicked.connect(self.click_record)
+        self.ui.camera_auto_exposure_button.clicked.connect(self.click_auto_exposure)
         self.ui.camera_connect_button.clicked.connect(self.thread_connect_camera)
         self.ui.measure_zero_button.clicked.connect(self.click_zero)
         self.ui.measure_freeze_button.clicked.connect(self.click_freeze)
         self.ui.measure_save_button.clicked.connect(self.click_save)
         self.ui.browse_button.clicked.connect(self.click_browse)
         self.ui.settings_save_config_button.clicked.connect(self.click_save_config)
+        self.ui.diagnostics_save_button.clicked.connect(self.click_save_diagnostics)
 
         # Check Boxes ----------------------------------------------------------------------------------------------- #
         self.ui.settings_circle_fit_check.clicked.connect(self.click_circle_fit)
 
         # Sliders --------------------------------------------------------------------------------------------------- #
-        self.ui.camera_exposure_slider.sliderReleased.connect(self.change_exposure)
-        self.ui.camera_gamma_slider.sliderReleased.connect(self.change_gamma)
-        self.ui.camera_exposure_slider.valueChanged.connect(lambda: self.change_exposure(just_label=True))
-        self.ui.camera_gamma_slider.valueChanged.connect(lambda: self.change_exposure(just_label=True))
+        self.ui.camera_replay_slider.sliderPressed.connect(lambda: self.scrub_replay(is_pressed=True))
+        self.ui.camera_replay_slider.sliderMoved.connect(lambda: self.scrub_replay())
+        self.ui.camera_replay_slider.sliderReleased.connect(lambda: self.scrub_replay(is_released=True))
+        # Every slider step is submitted; the camera's control queue coalesces a drag to its latest value
+        self.ui.camera_exposure_slider.valueChanged.connect(lambda: self.change_exposure())
+        self.ui.camera_gamma_slider.valueChanged.connect(lambda: self.change_gamma())
+
+        # Detection settings: publish a new snapshot on every change ------------------------------------------------ #
+        for spin in [self.ui.settings_threshold_spin, self.ui.settings_contour_limits_min_spin,
+                     self.ui.settings_contour_limits_max_spin, self.ui.settings_circularity_min_spin,
+                     self.ui.settings_circularity_max_spin]:
+            spin.valueChanged.connect(self.publish_detection_config)
+        for check in [self.ui.settings_circle_fit_check, self.ui.settings_tracking_check,
+                      self.ui.settings_crosshairs_check]:
+            check.toggled.connect(self.publish_detection_config)
 
         # Spin Boxes ------------------------------------------------------------------------------------------------ #
         self.ui.camera_exposure_spin.editingFinished.connect(lambda: self.change_exposure(spin_change=True))
@@ -83,6 +130,19 @@ class Widget(QWidget):
         if not self.is_test:
             self.thread_connect_camera()
 
+    def scrub_replay(self, is_pressed=False, is_released=False):
+        """
+        Pause a replay while its slider is held and show the frame under the slider.
+        :param is_pressed: (bool) Slider was pressed (pause).
+        :param is_released: (bool) Slider was released (resume).
+        """
+        if isinstance(self.camera, hw.ReplayCam):
+            if is_pressed:
+                self.camera.pause(True)
+            self.camera.seek(self.ui.camera_replay_slider.value())
+            if is_released:
+                self.camera.pause(False)
+
     def closeEvent(self, event: QCloseEvent):
         """
         Custom call for when close event is called on main window.
@@ -90,41 +150,72 @@ class Widget(QWidget):
         """
         self.hide()
         self.is_closed = True
-        time.sleep(1)
+        if self.stream is not None:
+            self.stream.stop()
 
+        if self.recorder is not None:
+            self.recorder.stop()
+        if self.is_own_writer:
+            self.image_writer.close()
         if self.camera is not None:
             self.camera.close()
 
         print("CLOSED")
 
+    def showEvent(self, event):
+        """
+        Custom call for when the window is shown: the stream is drawn again.
+        :param event: (QShowEvent) Qt flag of show event.
+        """
+        self.is_displayed = not self.isMinimized()
+        super(Widget, self).showEvent(event)
+
+    def hideEvent(self, event):
+        """
+        Custom call for when the window is hidden: the stream stops drawing overlays and previews.
+        :param event: (QHideEvent) Qt flag of hide event.
+        """
+        self.is_displayed = False
+        super(Widget, self).hideEvent(event)
+
+    def changeEvent(self, event):
+        """
+        Custom call for window state changes: the stream is not drawn while the window is minimized.
+        :param event: (QEvent) Qt flag for any event.
+        """
+        if event.type() == QtCore.QEvent.WindowStateChange:
+            self.is_displayed = self.isVisible() and not self.isMinimized()
+        super(Widget, self).changeEvent(event)
+
     def wheelEvent(self, event):
         """
         Custom call for scrolling wheel on mouse. Applies to only region with live stream.
         :param event: (QEvent) Qt flag for any event.
         """
-        if self.pixmap is not None:
+        if self.pixmap is not None and self.display_region is not None:
             if (20 < event.position().x() < 475) and (40 < event.position().y() < 375):
-                if event.angleDelta().y() > 0:
-                    factor = 1.25
-                    self.zoom += 1
-                else:
-                    factor = 0.8
-                    self.zoom -= 1
-
-                if self.zoom > 0:
-                    self.ui.stream_window.scale(factor, factor)
-                elif self.zoom == 0:
+                zoom = min(max(self.zoom + (1 if event.angleDelta().y() > 0 else -1), 0), 20)
+                if zoom == 0:
                     self.full_screen()
-                else:
-                    self.zoom = 0
+                elif zoom != self.zoom:
+                    # Keep the frame point under the mouse in place (the next preview is rendered around it)
+                    view = self.ui.stream_window
+                    scene_point = view.mapToScene(view.viewport().mapFrom(self, event.position().toPoint()))
+                    (x0, y0, x1, y1), scale = self.display_region
+                    point = (x0 + scene_point.x() / scale, y0 + scene_point.y() / scale)
+                    factor = 1.25 ** (zoom - self.zoom)
+                    self.zoom_center = (point[0] + ((x0 + x1) / 2 - point[0]) / factor,
+                                        point[1] + ((y0 + y1) / 2 - point[1]) / factor)
+                    self.zoom = zoom
 
         super(Widget, self).wheelEvent(event)
 
-    def change_exposure(self, spin_change=False, just_label=False):
+    def change_exposure(self, spin_change=False):
         """
-        Change exposure settings on camera.
-        :param spin_change: (bool) Was this change initiated by the spin box?
-        :param just_label: (bool) Was this change initiated by the slider?
+        Change exposure settings on camera and keep the spin box and slider in step. Every change (each slider step
+        and the echo of the other control) is queued on the camera's control thread, which coalesces them to the
+        latest value.
+        :param spin_change: (bool) Was this change initiated by the spin box? Otherwise by the slider.
         """
         if spin_change:
             new_value = int(self.ui.camera_exposure_spin.value())
@@ -133,14 +224,13 @@ class Widget(QWidget):
             new_value = int(self.ui.camera_exposure_slider.value())
             self.ui.camera_exposure_spin.setValue(new_value)
 
-        if not just_label and self.camera is not None:
-            self.camera.set_exposure(new_value=new_value)
+        if self.camera is not None:
+            self.camera.control.submit("exposure", new_value)
 
-    def change_gamma(self, spin_change=False, just_label=False):
+    def change_gamma(self, spin_change=False):
         """
-        Change gamma settings on camera.
-        :param spin_change: (bool) Was this change initiated by the spin box?
-        :param just_label: (bool) Was this change initiated by the slider?
+        Change gamma settings on camera (queued like change_exposure).
+        :param spin_change: (bool) Was this change initiated by the spin box? Otherwise by the slider.
         """
         if spin_change:
             new_value = float(self.ui.camera_gamma_spin.value())
@@ -149,8 +239,33 @@ class Widget(QWidget):
             new_value = float(self.ui.camera_gamma_slider.value()) / 10
             self.ui.camera_gamma_spin.setValue(new_value)
 
-        if not just_label and self.camera is not None:
-            self.camera.set_gamma(new_value=new_value)
+        if self.camera is not None:
+            self.camera.control.submit("gamma", new_value)
+
+    def click_auto_exposure(self):
+        """
+        Action for clicking the 'Auto' exposure button: converge the exposure into the GOOD saturation band and lock it.
+        """
+        if self.camera is not None and not self.camera.auto_exposure.is_running:
+            auto_settings = self.json_settings["Camera"].get("Auto Exposure", {})
+            self.ui.camera_auto_exposure_button.setEnabled(False)
+            self.camera.auto_exposure.start(target=auto_settings.get("Target", 0.75),
+                                            max_steps=auto_settings.get("Max Steps", 10),
+                                            exposure_limits=(self.ui.camera_exposure_spin.minimum(),
+                                                             self.ui.camera_exposure_spin.maximum()),
+                                            callback=lambda auto_exposure: self.auto_exposure_finished.emit())
+
+    def auto_exposure_done(self):
+        """
+        Show the exposure auto exposure settled on (GUI thread, queued from the auto exposure thread). The controls
+        are updated with their signals blocked, so the (rounded) value is not submitted back to the camera.
+        """
+        if self.camera is not None:
+            for control in [self.ui.camera_exposure_spin, self.ui.camera_exposure_slider]:
+                control.blockSignals(True)
+                control.setValue(int(round(self.camera.exposure_us)))
+                control.blockSignals(False)
+        self.ui.camera_auto_exposure_button.setEnabled(True)
 
     def click_browse(self):
         """
@@ -177,13 +292,28 @@ class Widget(QWidget):
                 now = datetime.now()
                 exposure_us = int(self.ui.camera_exposure_spin.text())
                 gamma_10 = int(float(self.ui.camera_gamma_spin.text()))
-                image_name = "image_%s_%sus_%s.png" % (now.strftime("%Y%m%d-%H%M%S"), exposure_us, gamma_10)
-            elif not image_name.endswith(".png"):
-                image_name = "%s.png" % image_name
+                image_name = "image_%s_%sus_%s" % (now.strftime("%Y%m%d-%H%M%S"), exposure_us, gamma_10)
 
-            # Check path and save
-            image_path = hw.check_path(os.path.join(folder, image_name))
-            self.thread_save_image(image_path, self.raw_frame)
+            # Save (the writer picks a free name and the extension of the configured format)
+            self.thread_save_image(os.path.join(folder, image_name), self.raw_frame)
+
+    def click_record(self):
+        """
+        Action for clicking the 'Record' button: start or stop recording every frame to the save path.
+        """
+        if self.recorder is None:
+            if self.camera is not None:
+                folder = self.ui.save_path_entry.toPlainText()
+                if not os.path.exists(folder):
+                    os.mkdir(folder)
+                chunk_mb = self.json_settings.get("Recording", {}).get("Chunk MB", 1024)
+                self.recorder = rec.FrameRecorder(self.camera, folder, chunk_mb=chunk_mb)
+                self.recorder.start()
+                self.ui.camera_record_button.setText("Stop")
+        else:
+            self.recorder.stop()
+            self.recorder = None
+            self.ui.camera_record_button.setText("Record")
 
     def click_circle_fit(self):
         """
@@ -249,6 +379,14 @@ class Widget(QWidget):
         # Enable save button
         self.ui.measure_save_button.setEnabled(True)
 
+    def click_save_diagnostics(self):
+        """
+        Action for clicking the diagnostics 'Save CSV' button.
+        """
+        file_path = os.path.join(self.folder_path, "diagnostics_%s.csv" % datetime.now().strftime("%Y%m%d-%H%M%S"))
+        self.stats.save_csv(file_path)
+        print("Saved diagnostics to:", file_path)
+
     def click_save_config(self):
         """
         Action for clicking the 'Save to Config' button.
@@ -258,6 +396,7 @@ class Widget(QWidget):
         threshold = self.ui.settings_threshold_spin.value()
         circularity = [self.ui.settings_circularity_min_spin.value(), self.ui.settings_circularity_max_spin.value()]
         circle_fit = int(self.ui.settings_circle_fit_check.isChecked())
+        tracking = int(self.ui.settings_tracking_check.isChecked())
         exposure = self.ui.camera_exposure_spin.value()
         gamma = self.ui.camera_gamma_spin.value()
 
@@ -267,6 +406,7 @@ class Widget(QWidget):
             self.json_settings["Detection"]["Contours"] = contour_limits
             self.json_settings["Detection"]["Circularity"] = circularity
             self.json_settings["Detection"]["Circle Fit"] = circle_fit
+            self.json_settings["Detection"]["Tracking"] = tracking
             self.json_settings["Camera"]["Exposure us"] = exposure
             self.json_settings["Camera"]["Gamma"] = gamma
             with open(self.settings_path, "w") as f:
@@ -312,18 +452,83 @@ class Widget(QWidget):
 
     def full_screen(self):
         """
-        Full screen the image on the streaming window.
+        Full screen the image on the streaming window. Previews are rendered at the resolution of the window (see
+        ip.render_preview), so the view itself is shown unscaled and zooming only changes the rendered region.
         """
-        rect = QtCore.QRectF(self.pixmap.rect())
-        if not rect.isNull():
-            self.ui.stream_window.setSceneRect(rect)
-            unity = self.ui.stream_window.transform().mapRect(QtCore.QRectF(0, 0, 1, 1))
-            self.ui.stream_window.scale(1 / unity.width(), 1 / unity.height())
-            view_rect = self.ui.stream_window.viewport().rect()
-            scene_rect = self.ui.stream_window.transform().mapRect(rect)
-            factor = min(view_rect.width() / scene_rect.width(), view_rect.height() / scene_rect.height())
-            self.ui.stream_window.scale(factor, factor)
-            self.zoom = 0
+        self.zoom = 0
+        self.zoom_center = None
+        self.view_size = (self.ui.stream_window.viewport().width(), self.ui.stream_window.viewport().height())
+        self.ui.stream_window.resetTransform()
+        if self.pixmap is not None:
+            self.ui.stream_window.setSceneRect(QtCore.QRectF(self.pixmap.rect()))
+
+    @QtCore.Slot()
+    def render_frame(self):
+        """
+        Show the latest display frame on the stream window (GUI thread). Frames that arrived while this call was
+        queued were replaced by newer ones, so the display never lags behind the stream.
+        """
+        self.is_render_pending = False
+        if self.display_frame is None or self.is_closed:
+            return
+        frame, self.display_region = self.display_frame
+
+        with self.stats.timer("display"):
+            s = frame.shape
+            is_new_size = self.pixmap is None or (self.pixmap.width(), self.pixmap.height()) != (s[1], s[0])
+            self.pixmap = QPixmap.fromImage(QImage(frame, s[1], s[0], 3 * s[1], QImage.Format_RGB888))
+            self.pixmap_item.setPixmap(self.pixmap)
+            if is_new_size:
+                self.ui.stream_window.setSceneRect(QtCore.QRectF(self.pixmap.rect()))
+        self.stats.tick("displayed")
+        self.show_measurements()
+        self.update_diagnostics()
+
+        slider = self.ui.camera_replay_slider
+        if isinstance(self.camera, hw.ReplayCam) and not slider.isSliderDown():
+            slider.setValue(self.camera.frame_num - 1)
+        if self.is_first_frame:
+            self.full_screen()
+            self.is_first_frame = False
+
+    def publish_detection_config(self):
+        """
+        Publish the detection settings of the GUI as a new snapshot. The stream picks it up by reference on its next
+        frame, so it never reads a half-updated set of settings or calls into Qt.
+        """
+        self.detection_config = ip.make_detection_config(
+            self.json_settings["Detection"], threshold=self.ui.settings_threshold_spin.value(),
+            contour_limits=(self.ui.settings_contour_limits_min_spin.value(),
+                            self.ui.settings_contour_limits_max_spin.value()),
+            circle_limits=(self.ui.settings_circularity_min_spin.value(),
+                           self.ui.settings_circularity_max_spin.value()),
+            fit_circle=self.ui.settings_circle_fit_check.isChecked(),
+            tracking=self.ui.settings_tracking_check.isChecked(),
+            crosshairs=self.ui.settings_crosshairs_check.isChecked())
+
+    def show_measurements(self):
+        """
+        Show the latest saturation and blob measurements of the stream (GUI thread).
+        """
+        palette = self.ui.saturation_status_label.palette()
+        palette.setColor(QPalette.WindowText, QColor("green" if self.blob_kpis["level"] == "GOOD" else "red"))
+        self.ui.saturation_status_label.setPalette(palette)
+        self.ui.saturation_status_label.setText(self.blob_kpis["level"])
+        self.ui.saturation_value_label.setText("%.4f %%" % self.blob_kpis["saturation"])
+
+        self.ui.measure_detected_position.setText("(%i, %i)" % self.last_detected)
+        self.ui.measure_zero_position.setText("(%i, %i)" % self.blob_kpis["zero"])
+        self.ui.measure_zero_button.setEnabled(not self.is_zeroed)
+        self.ui.measure_delta_position.setText("(%.3f, %.3f)" % self.blob_kpis["delta"])
+
+    def update_diagnostics(self):
+        """
+        Refresh the diagnostics panel (once per second, while it is shown).
+        """
+        now = time.perf_counter()
+        if now - self.last_diagnostics > 1 and self.ui.diagnostics_tab.isVisible():
+            self.ui.diagnostics_table_label.setText(self.stats.report())
+            self.last_diagnostics = now
 
     def make_params_dict(self):
         """
@@ -349,6 +554,7 @@ class Widget(QWidget):
             "Circle Fit": bool(self.ui.settings_circle_fit_check.isChecked()),
             "Circle Min": self.ui.settings_circularity_min_spin.value(),
             "Circle Max": self.ui.settings_circularity_max_spin.value(),
+            "Tracking": bool(self.ui.settings_tracking_check.isChecked()),
             "Comments": self.ui.parameters_sn_entry.toPlainText(),
             "": "",
             "Code Version": self.json_settings["Version"],
@@ -357,7 +563,8 @@ class Widget(QWidget):
             "AMPF": self.json_settings["Camera"]["Arcmin/pxl"],
             "Poly Fit": self.json_settings["Detection"]["Poly Fit"],
             "Gaussian": self.json_settings["Detection"]["Gaussian"],
-            "Feature Size": self.json_settings["Detection"]["Feature Size"]
+            "Feature Size": self.json_settings["Detection"]["Feature Size"],
+            "Pyramid": self.json_settings["Detection"].get("Pyramid", 1)
         }
 
         return input_params
@@ -369,7 +576,7 @@ class Widget(QWidget):
         # Other
         self.armin_per_pxl = self.json_settings["Camera"]["Arcmin/pxl"]
         self.pxl_size_mm = self.json_settings["Camera"]["Pixel Size mm"]
-        device_id = self.json_settings["Camera"]["ID"]
+        device_id = hw.get_device_id(self.json_settings["Camera"], self.camera_num)
         self.folder_path = self.json_settings["Save Path"]
         self.blob_kpis = {"zero": (0, 0), "detected": (0, 0), "delta": (0, 0), "saturation": 0, "level": ""}
 
@@ -388,7 +595,9 @@ class Widget(QWidget):
         if self.ui.settings_circle_fit_check.isChecked():
             self.ui.settings_circularity_min_spin.setEnabled(True)
             self.ui.settings_circularity_max_spin.setEnabled(True)
+        self.ui.settings_tracking_check.setChecked(bool(self.json_settings["Detection"].get("Tracking", 0)))
         self.ui.stream_label.setText("Camera Stream %i" % device_id)
+        self.setWindowTitle("Blob Detection - Camera %i" % device_id)
 
     def thread_connect_camera(self):
         """
@@ -399,19 +608,28 @@ class Widget(QWidget):
 
     def thread_save_image(self, save_path, frame_to_save):
         """
-        Thread call for saving an image.
+        Queue an image on the image writer thread (the frame is copied, ring slots are reused by the camera).
         :param save_path: (str) Path to where image should be saved including file name.
         :param frame_to_save: (np.array) Image frame to save.
+        :return: (str) Path the image is saved to or None if it was rejected (writer backlog full).
         """
-        worker = ThreadSave(save_path, frame_to_save, parent=self)
-        self.threadpool.start(worker)
+        if self.is_test or self.is_closed:
+            return None
+        save_path = self.image_writer.save(save_path, frame_to_save)
+        self.stats.set_counter("save_backlog", self.image_writer.backlog())
+        self.stats.set_counter("save_rejected", self.image_writer.rejected)
+        self.stats.set_counter("save_failed", self.image_writer.failed)
+
+        return save_path
 
     def thread_stream(self):
         """
-        Thread call for starting the camera stream to UI main window..
+        Thread call for starting the camera stream to UI main window.
         """
-        worker = ThreadStream(parent=self)
-        self.threadpool.start(worker)
+        if self.stream is not None:
+            self.stream.stop()
+        self.stream = ThreadStream(parent=self)
+        self.stream.start()
 
 
 class ThreadLoadHW(QtCore.QRunnable):
@@ -441,10 +659,18 @@ class ThreadLoadHW(QtCore.QRunnable):
         if self.device == 1:
             self.root.ui.camera_connect_button.setEnabled(False)
             if self.root.camera is None:
-                if self.root.json_settings["Camera"]["Sensor"] == "AmScope":
-                    self.root.camera = hw.AmScopeCamNI(self.root.json_settings["Camera"]["ID LR"][self.root.camera_num])
-                if self.root.camera.device is not None:
+                camera_settings = self.root.json_settings["Camera"]
+                if self.root.replay_path is not None:
+                    replay_settings = dict(camera_settings.get("Replay", {}), Session=self.root.replay_path)
+                    camera_settings = dict(camera_settings, Backend="Replay", Replay=replay_settings)
+                self.root.camera = hw.load_camera(camera_settings,
+                                                  hw.get_device_id(camera_settings, self.root.camera_num),
+                                                  stats=self.root.stats)
+                if self.root.camera is not None and self.root.camera.device is not None:
                     print("CAMERA SUCCESS")
+                    if isinstance(self.root.camera, hw.ReplayCam):
+                        self.root.ui.camera_replay_slider.setMaximum(len(self.root.camera.recording) - 1)
+                        self.root.ui.camera_replay_slider.setEnabled(True)
                     self.change_color(self.root.ui.camera_connect_indicator, "green")
                     self.root.change_exposure(spin_change=True)
                     self.root.change_gamma(spin_change=True)
@@ -455,6 +681,10 @@ class ThreadLoadHW(QtCore.QRunnable):
                     self.root.camera = None
             else:
                 self.change_color(self.root.ui.camera_connect_indicator, "gray")
+                self.root.ui.camera_replay_slider.setEnabled(False)
+                if self.root.stream is not None:
+                    self.root.stream.stop()
+                    self.root.stream = None
                 self.root.camera.close()
                 self.root.camera = None
             self.root.ui.camera_connect_button.setEnabled(True)
@@ -468,198 +698,232 @@ class ThreadLoadHW(QtCore.QRunnable):
         indicator.setStyleSheet("QRadioButton::indicator{background-color : %s}" % color)
 
 
-class ThreadStream(QtCore.QRunnable):
+class ThreadStream:
 
     def __init__(self, parent=None):
         """
-        Stream image frames from connected camera.
+        Stream image frames from connected camera through a staged pipeline: acquire (wait for the next frame in the
+        camera's frame ring) -> analyse (saturation and blob detection) -> render (overlays and display preview) and
+        log (diagnostics). Each stage runs on its own thread and sleeps until the stage before it has a new result.
         :param parent: (QWidget) Qt main window handle.
         """
-        super().__init__()
         self.root = parent
         self.font = cv2.FONT_HERSHEY_PLAIN
         self.feature_size = 8
         self.colors = ["R", "G", "B"]
-        self.is_first = True
+        self.ring = None
+        self.last_display = 0
+        self.display_interval = 1 / self.root.json_settings.get("Display", {}).get("Max FPS", 30)
+        self.skipped = 0
+        self.sequence = 0
+        self.context = None
+        self.pipeline = pipe.Pipeline(stats=self.root.stats)
+        self.pipeline.add_stage("acquire", self.acquire)
+        self.pipeline.add_stage("analyse", self.analyse)
+        self.pipeline.add_stage("render", self.render)
+        self.pipeline.add_stage("log", self.log, after="analyse", maxsize=8)
 
-    @QtCore.Slot()
     def start(self):
         """
-        Connect slot to run() function.
+        Start the pipeline threads. A replay that is not realtime is processed frame by frame (lockstep).
         """
         if not self.root.is_test:
-            self.run()
+            camera = self.root.camera
+            self.pipeline.is_lockstep = isinstance(camera, hw.ReplayCam) and not camera.is_realtime
+            self.pipeline.start()
 
-    def run(self):
+    def stop(self):
         """
-        Run thread: Stream image with blob detection and saturation measurements.
-        """
-        while self.root.camera is None:
-            time.sleep(0.01)
-
-        while not self.root.is_closed:
-            try:
-                # Get frame and format it into RGB 8-bit
-                while self.root.is_dialog_open is None:
-                    time.sleep(0.01)
-                self.root.raw_frame = self.root.camera.current_frame.copy()
-                self.get_saturation()
-                self.detect_blob()
-                if self.root.drawn_frame.any():
-                    img_array = self.root.drawn_frame.copy()
-                else:
-                    img_array = self.root.raw_frame.copy()
-                img_array = ip.convert_color_bit(img_array, "rgb", 8)
-
-                if img_array.any():
-                    s = img_array.shape
-                    pic = QGraphicsPixmapItem()
-                    self.root.pixmap = QPixmap.fromImage(QImage(img_array, s[1], s[0], 3 * s[1], QImage.Format_RGB888))
-                    pic.setPixmap(self.root.pixmap)
-                    self.root.ui.scene = QGraphicsScene()
-                    self.root.ui.scene.addItem(pic)
-                    self.root.ui.stream_window.setScene(self.root.ui.scene)
-
-                    if self.is_first:
-                        self.root.full_screen()
-                        self.is_first = False
-            except (AttributeError, IndexError) as er:
-                pass
-            except Exception as er:
-                print(er)
-                pass
-
-    def detect_blob(self):
+        Stop the pipeline and wait for every stage to finish its current frame.
         """
-        Detect blobs in current image frame.
+        self.pipeline.stop()
+
+    def acquire(self):
+        """
+        Acquire stage: wait for the next frame (read from the camera's frame ring without copying).
+        :return: (ip.FrameContext) Context of the new frame or None if none arrived.
+        """
+        camera = self.root.camera
+        if camera is None or camera.ring.is_closed:
+            time.sleep(0.1)
+            return None
+        if camera.ring is not self.ring:
+            self.ring = camera.ring
+            self.sequence = 0
+        sequence, timestamp, frame = self.ring.wait_for_frame(self.sequence, timeout=0.25)
+        if frame is None:
+            return None
+        self.sequence = sequence
+        self.root.stats.set_counter("dropped", self.ring.dropped)
+
+        return ip.FrameContext(frame, sequence)
+
+    def analyse(self, context):
+        """
+        Analyse stage: measure saturation and detect blobs in a frame. The detection settings are the snapshot the GUI
+        published last (see Widget.publish_detection_config), picked up once per frame.
+        :param context: (ip.FrameContext) Frame to analyse.
+        :return: (ip.FrameContext, dict list, ip.DetectionConfig) The frame, its measured blobs and the settings.
+        """
+        config = self.root.detection_config
+        self.context = context
+        self.root.raw_frame = context.image_array
+        with self.root.stats.timer("saturation"):
+            self.get_saturation(config)
+        blobs = self.detect_blob(config)
+
+        return context, blobs, config
+
+    def render(self, result):
+        """
+        Render stage: draw overlays and hand the display preview to the GUI thread, at most "Max FPS" (see "Display"
+        in the config) times per second and only while the window is displayed. Other frames are skipped without
+        drawing.
+        :param result: (ip.FrameContext, dict list, ip.DetectionConfig) Output of the analyse stage.
+        """
+        now = time.perf_counter()
+        if now - self.last_display < self.display_interval or not self.root.is_displayed:
+            self.skipped += 1
+            self.root.stats.set_counter("display_skipped", self.skipped)
+            return None
+        self.last_display = now
+
+        context, blobs, config = result
+        with self.root.stats.timer("overlay"):
+            self.root.drawn_frame = self.draw_overlay(context, blobs, config)
+        if self.root.drawn_frame is not None and self.root.drawn_frame.size:
+            self.publish_frame(self.root.drawn_frame)
+
+        return None
+
+    def log(self, result):
+        """
+        Log stage: count analysed frames and report the backlog of the pipeline and image writer and its failed
+        writes (the GUI thread shows them on the diagnostics panel).
+        :param result: (ip.FrameContext, dict list, ip.DetectionConfig) Output of the analyse stage.
+        """
+        self.root.stats.tick("analysed")
+        self.root.stats.set_counter("save_backlog", self.root.image_writer.backlog())
+        self.root.stats.set_counter("save_failed", self.root.image_writer.failed)
+        for stage, backlog in self.pipeline.backlog().items():
+            self.root.stats.set_counter("backlog_%s" % stage, backlog)
+
+        return None
+
+    def detect_blob(self, config):
         """
-        if self.root.raw_frame.any():
-            # Detect blob with settings
-            threshold = self.root.ui.settings_threshold_spin.value()
-            contours = [self.root.ui.settings_contour_limits_min_spin.value(),
-                        self.root.ui.settings_contour_limits_max_spin.value()]
-            circle_limits = [self.root.ui.settings_circularity_min_spin.value(),
-                             self.root.ui.settings_circularity_max_spin.value()]
-            self.root.drawn_frame, detected = ip.detect_blob(self.root.raw_frame, threshold=threshold,
-                                                             contour_limits=contours, circle_limits=circle_limits,
-                                                             zero_point=self.root.blob_kpis["zero"],
-                                                             m_point=self.root.blob_kpis["detected"],
-                                                             fit_circle=self.root.is_circle_fit)
-
-            # Add cross-hairs if requested
-            if self.root.ui.settings_crosshairs_check.isChecked() and self.root.drawn_frame.any():
-                s = self.root.drawn_frame.shape
-                feature_sz = self.root.json_settings["Detection"]["Feature Size"]
-                ch_center = (int(s[1] / 2), int(s[0] / 2))
-                cv2.line(self.root.drawn_frame, (ch_center[0], (ch_center[1] - feature_sz * 10)),
-                         (ch_center[0], (ch_center[1] + feature_sz * 10)), (0, 0, 0), thickness=feature_sz)
-                cv2.line(self.root.drawn_frame, ((ch_center[0] - feature_sz * 10), ch_center[1]),
-                         ((ch_center[0] + feature_sz * 10), ch_center[1]), (0, 0, 0), thickness=feature_sz)
-
-            # Update stored KPIs
-            self.root.ui.measure_detected_position.setText("(%i, %i)" % (detected[0], detected[1]))
+        Detect blobs in current image frame.
+        :param config: (ip.DetectionConfig) Detection settings.
+        :return: (dict list) Output of ip.measure_blobs.
+        """
+        blobs = []
+        if self.root.raw_frame.size:
+            # Measure on the detection pool (shared by all cameras of this process)
+            with self.root.stats.timer("detect"):
+                if config.tracking:
+                    measure = self.root.tracker.measure
+                else:
+                    self.root.tracker.reset()
+                    measure = ip.measure_blobs
+                blobs = self.root.detection_pool.submit(measure, self.root.raw_frame, context=self.context,
+                                                        config=config).result()
+            detected = ip.blob_center(blobs)
+
+            # Update stored KPIs (shown by the GUI thread, see Widget.show_measurements)
+            self.root.last_detected = detected
             if self.root.is_zeroed:
                 answer = 6
                 if self.root.blob_kpis["zero"] != (0, 0):
                     answer = self.root.dialog_prompt("Zero already set. Would you like to overwrite?", button=0x04)
                 if answer == 6:
                     self.root.blob_kpis["zero"] = detected
-                    self.root.ui.measure_zero_position.setText("(%i, %i)" % (self.root.blob_kpis["zero"][0],
-                                                                             self.root.blob_kpis["zero"][1]))
                     self.root.is_zeroed = False
-                    self.root.ui.measure_zero_button.setEnabled(True)
             if not self.root.is_frozen:
                 self.root.blob_kpis["detected"] = detected
                 delta = ((self.root.blob_kpis["detected"][0] - self.root.blob_kpis["zero"][0]) * self.root.armin_per_pxl,
                          (self.root.blob_kpis["zero"][1] - self.root.blob_kpis["detected"][1]) * self.root.armin_per_pxl)
                 self.root.blob_kpis["delta"] = delta
-                self.root.ui.measure_delta_position.setText("(%.3f, %.3f)" % (self.root.blob_kpis["delta"][0],
-                                                                              self.root.blob_kpis["delta"][1]))
-
-    def get_saturation(self):
-        """
-        Calculate saturation levels in current image frame.
-        :return:
-        """
-        if self.root.raw_frame.any():
-            measure_frame = ip.convert_color_bit(self.root.raw_frame.copy(), "mono", 16)
-
-            # Calculate brightness (not currently used)
-            total_pixels = measure_frame.shape[0] * measure_frame.shape[1]
-            brightness = np.sum(measure_frame, dtype='uint64') / total_pixels
-
-            # Define the saturation of the image
-            frame_flat = np.array(measure_frame.copy().flatten())
-            sat_limits = [int((2 ** 16 - 256) * 0.50), int((2 ** 16 - 256) * 0.95)]  # low: 50%, high: 95%
-            sat_threshold = round(0.001 * total_pixels)  # typically 0.00001 not 0.001
-            sat_array = frame_flat[frame_flat >= sat_limits[0]]
-            is_low_sat = bool(len(sat_array) <= sat_threshold)
-            if not is_low_sat:
-                sat_array = frame_flat[frame_flat >= sat_limits[1]]
-                is_high_sat = bool(len(sat_array) >= sat_threshold)
-            else:
-                is_high_sat = False
-            sat_percent = (sat_array >= sat_limits[1]).sum() / total_pixels * 100
-
-            # Update GUI widgets
-            self.root.ui.saturation_value_label.setText("%.4f %%" % sat_percent)
-            palette = self.root.ui.saturation_status_label.palette()
-            if is_high_sat:
-                label_style = ["HIGH", "red"]
-            elif is_low_sat:
-                label_style = ["LOW", "red"]
-            else:
-                label_style = ["GOOD", "green"]
-            palette.setColor(QPalette.WindowText, QColor(label_style[1]))
-            self.root.ui.saturation_status_label.setPalette(palette)
-            self.root.ui.saturation_status_label.setText(label_style[0])
-
-            # Add data to KPIs
-            self.root.blob_kpis["saturation"] = sat_percent
-            self.root.blob_kpis["level"] = label_style[0]
 
+        return blobs
 
-class ThreadSave(QtCore.QRunnable):
-    def __init__(self, save_path, frame_to_save, parent=None):
+    def draw_overlay(self, context, blobs, config):
         """
-        Stream image frames from connected camera.
-        :param save_path: (str) Path to where image should be saved including file name.
-        :param frame_to_save: (np.array) Image frame to save.
-        :param parent: (QWidget) Qt main window handle.
+        Draw the measured blobs, zero point, measured point and cross-hairs (if requested) on a frame.
+        :param context: (ip.FrameContext) Frame the blobs were measured on.
+        :param blobs: (dict list) Output of ip.measure_blobs.
+        :param config: (ip.DetectionConfig) Detection settings (feature size, colors and cross-hairs).
+        :return: (np.array) RGB 8-bit frame with overlays.
         """
-        super().__init__()
-        self.frame_to_save = frame_to_save
-        self.save_path = hw.check_path(save_path)
-        self.root = parent
+        drawn_frame = ip.draw_blobs(context.rgb8(), blobs, zero_point=self.root.blob_kpis["zero"],
+                                    m_point=self.root.blob_kpis["detected"], buffer="overlay", config=config)
 
-    @QtCore.Slot()
-    def start(self):
+        # Add cross-hairs if requested
+        if config.crosshairs and drawn_frame is not None:
+            s = drawn_frame.shape
+            feature_sz = config.feature_size
+            ch_center = (int(s[1] / 2), int(s[0] / 2))
+            cv2.line(drawn_frame, (ch_center[0], (ch_center[1] - feature_sz * 10)),
+                     (ch_center[0], (ch_center[1] + feature_sz * 10)), config.colors["crosshairs"],
+                     thickness=feature_sz)
+            cv2.line(drawn_frame, ((ch_center[0] - feature_sz * 10), ch_center[1]),
+                     ((ch_center[0] + feature_sz * 10), ch_center[1]), config.colors["crosshairs"],
+                     thickness=feature_sz)
+
+        return drawn_frame
+
+    def publish_frame(self, img_array):
         """
-        Connect slot to run() function.
+        Hand a processed frame to the GUI thread for display. Only the visible region is handed over, rendered at the
+        resolution of the stream window; measurements keep the full-resolution frame.
+        :param img_array: (np.array) Full-resolution RGB 8-bit frame to display.
         """
-        if not self.root.is_test:
-            self.run()
+        with self.root.stats.timer("preview"):
+            region, scale = ip.preview_region(img_array.shape, self.root.view_size, self.root.zoom,
+                                              self.root.zoom_center)
+            self.root.display_frame = (ip.render_preview(img_array, region, scale), (region, scale))
+        if not self.root.is_render_pending:
+            self.root.is_render_pending = True
+            self.root.frame_ready.emit()
 
-    def run(self):
+    def get_saturation(self, config):
         """
-        Run thread: Save input image
+        Calculate saturation levels in current image frame (shown by the GUI thread, see Widget.show_measurements).
+        :param config: (ip.DetectionConfig) Detection settings (histogram stride).
         """
-        if not self.root.is_closed:
-            cv2.imwrite(self.save_path, cv2.cvtColor(self.frame_to_save, cv2.COLOR_BGR2RGB))
+        if self.root.raw_frame.size:
+            saturation = ip.measure_saturation(self.context.histogram(stride=config.saturation_stride))
+
+            # Add data to KPIs
+            self.root.blob_kpis["saturation"] = saturation["saturation"]
+            self.root.blob_kpis["level"] = saturation["level"]
 
 
 def launch_gui(camera_num):
     """
-    Launch the main GUI.
-    :param camera_num: (int) Camera ID.
+    Launch the main GUI: one window per camera, all in this process and sharing one detection worker pool.
+    :param camera_num: (int or int list) Camera number(s): index into the "ID LR" device list.
     """
     args = dict(argParser.parse_args()._get_kwargs())
     if args["cam_num"] is not None:
         camera_num = args["cam_num"]
+    camera_nums = camera_num if isinstance(camera_num, list) else [camera_num]
     app = QApplication(sys.argv)
-    widget = Widget(camera_num)
-    widget.show()
-    sys.exit(app.exec())
+    workers = ip.json_settings["Detection"].get("Workers", min(len(camera_nums), os.cpu_count() or 1))
+    detection_pool = ThreadPoolExecutor(max_workers=workers)
+    save_settings = ip.json_settings.get("Saving", {})
+    image_writer = rec.ImageWriter(max_pending=save_settings.get("Queue Size", 8),
+                                   image_format=save_settings.get("Format", "png"),
+                                   png_compression=save_settings.get("PNG Compression", 1))
+    widgets = []
+    for i, num in enumerate(camera_nums):
+        widget = Widget(num, replay_path=args["replay"], detection_pool=detection_pool, image_writer=image_writer)
+        widget.show()
+        widget.move(widget.x() + i * (widget.frameGeometry().width() + 10), widget.y())
+        widgets.append(widget)
+    exit_code = app.exec()
+    detection_pool.shutdown(wait=False)
+    image_writer.close()
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
@@ -18,8 +18,7 @@ VERSION = '1.1.0'
 here = os.path.abspath(os.path.dirname(__file__))
 
 # Required or optional package dependencies
-REQUIRED = ["PyQt5", "PySide6", "circle-fit", "matplotlib>=3.5.3", "opencv-contrib-python", "pandas>=1.3.5", "pylablib",
-            "scipy>=1.7.3"]
+REQUIRED = ["PyQt5", "PySide6", "opencv-contrib-python", "pandas>=1.3.5", "pylablib", "scipy>=1.7.3"]
 try:
     with io.open(os.path.join(here, 'README.md'), encoding='utf-8') as f:
         long_description = '\n' + f.read()
@@ -88,6 +87,11 @@ setup(
     # data_files=[("tetons/support")],
     install_requires=REQUIRED,
     include_package_data=True,
+    package_data={NAME: ["support/*.json"]},
+    entry_points={
+        # Qt-free measurement runner (see blob_detection/measure.py)
+        'console_scripts': ['blob-detect=blob_detection.measure:run_measurement'],
+    },
     license='MIT',
     classifiers=[
         # Full list: https://pypi.python.org/pypi?%3Aaction=list_classifiers
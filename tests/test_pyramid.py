@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+import blob_detection.img_processing as ip
+
+SHAPE = (1520, 1920)
+LIMITS = {"threshold": 150, "contour_limits": [250, 1500]}
+
+
+def assert_same_blobs(pyramid_blobs, full_blobs):
+    """
+    Check that a pyramid search found the same blobs, in the same order and at the same centers, as a full search.
+    :param pyramid_blobs: (dict list) Output of measure_blobs with pyramid > 1.
+    :param full_blobs: (dict list) Output of measure_blobs at full resolution.
+    """
+    assert [blob["bbox"] for blob in pyramid_blobs] == [blob["bbox"] for blob in full_blobs]
+    for pyramid_blob, full_blob in zip(pyramid_blobs, full_blobs):
+        assert np.allclose(pyramid_blob["center"], full_blob["center"])
+        assert pyramid_blob["area"] == full_blob["area"]
+    assert ip.blob_center(pyramid_blobs) == ip.blob_center(full_blobs)
+
+
+@pytest.mark.parametrize("pyramid", [2, 4])
+@pytest.mark.parametrize("color,bit_depth", [("rgb", 8), ("rgb", 16), ("mono", 8), ("mono", 16)])
+@pytest.mark.parametrize("fit_circle", [False, True])
+def test_single_blob(pyramid, color, bit_depth, fit_circle):
+    frame = ip.synthetic_frame(SHAPE, [(SHAPE[1] / 2 + 0.3, SHAPE[0] / 2 + 0.7)], color=color, bit_depth=bit_depth)
+    full_blobs = ip.measure_blobs(frame, fit_circle=fit_circle, **LIMITS)
+    assert len(full_blobs) == 1
+    assert_same_blobs(ip.measure_blobs(frame, fit_circle=fit_circle, pyramid=pyramid, **LIMITS), full_blobs)
+
+
+@pytest.mark.parametrize("pyramid", [2, 4])
+@pytest.mark.parametrize("seed", range(0, 200, 4))
+def test_many_blobs(pyramid, seed):
+    # Random placement puts several blobs on the same coarse row, where the coarse contour order differs
+    centers = np.random.default_rng(seed).uniform((40, 40), (SHAPE[1] - 40, SHAPE[0] - 40), size=(20, 2))
+    frame = ip.synthetic_frame(SHAPE, centers, seed=seed)
+    assert_same_blobs(ip.measure_blobs(frame, pyramid=pyramid, **LIMITS), ip.measure_blobs(frame, **LIMITS))
+
+
+def test_no_blobs():
+    frame = ip.synthetic_frame(SHAPE, [])
+    assert ip.measure_blobs(frame, pyramid=4, **LIMITS) == []